@@ -0,0 +1,106 @@
+""" Generate synthetic logs to benchmark against.
+
+`auth' logs look like /var/log/auth.log, and their matching lines
+are failed password attempts as parsed by `failed_attempts'
+(logparser/parsers/simple/example.yml). `pingbound' logs look like
+Tor logs, and their matching lines are parsed by `pingbound-old'.
+The same arguments always give the same log.
+
+    $ python benchmarks/corpus.py auth --lines 1000000 --hit-ratio 0.05 -o auth.log
+"""
+import argparse
+import datetime
+import random
+
+START = datetime.datetime(2013, 8, 21, 18, 5, 4)
+
+USERS = ('root', 'admin', 'oracle', 'test', 'invalid user bob',
+         'invalid user guest', 'ubuntu', 'postgres')
+HOSTS = ('host.local', 'gateway', 'db.example')
+
+AUTH_HIT = ("{time} {host} sshd[{pid}]: Failed password for {user} "
+            "from {ip} port {port} ssh2\n")
+AUTH_MISS = (
+    "{time} {host} sshd[{pid}]: Accepted publickey for {user} "
+    "from {ip} port {port} ssh2\n",
+    "{time} {host} CRON[{pid}]: pam_unix(cron:session): session opened "
+    "for user root by (uid=0)\n",
+    "{time} {host} sshd[{pid}]: Received disconnect from {ip}: 11: "
+    "Bye Bye [preauth]\n"
+)
+
+PING_HIT = ("{time}.{ms:03d} [notice] [PingBound] {result} Circuit {pid} "
+            "[lbound: {lbound:.2f}, ubound: {ubound:.2f}, "
+            "latency: {latency:.2f}]\n")
+PING_MISS = (
+    "{time}.{ms:03d} [notice] Bootstrapped 100%: Done.\n",
+    "{time}.{ms:03d} [info] circuit_build_times_add_time(): Adding circuit "
+    "build time {pid}\n",
+    "{time}.{ms:03d} [notice] Heartbeat: Tor's uptime is {pid} hours, with "
+    "{port} circuits open.\n"
+)
+
+
+def _fields(rand, i):
+  when = START + datetime.timedelta(seconds=i // 10)
+  lbound = rand.uniform(10, 200)
+  return {
+      'time': when.strftime('%b %d %H:%M:%S'),
+      'ms': rand.randint(0, 999),
+      'host': rand.choice(HOSTS),
+      'pid': rand.randint(100, 65535),
+      'user': rand.choice(USERS),
+      'ip': '{0}.{1}.{2}.{3}'.format(*[rand.randint(1, 254)
+                                       for _ in xrange(4)]),
+      'port': rand.randint(1024, 65535),
+      'result': rand.choice(('Passed.', 'Failed.')),
+      'lbound': lbound,
+      'ubound': lbound + rand.uniform(10, 500),
+      'latency': rand.uniform(5, 800)
+  }
+
+
+KINDS = {
+    'auth': (AUTH_HIT, AUTH_MISS),
+    'pingbound': (PING_HIT, PING_MISS)
+}
+
+
+def lines(kind, count, hit_ratio, seed=0):
+  """ Yield :count: lines of a :kind: log (one of KINDS), of
+  which about :hit_ratio: match its parser """
+  hit, misses = KINDS[kind]
+  rand = random.Random(seed)
+  for i in xrange(count):
+    fields = _fields(rand, i)
+    if rand.random() < hit_ratio:
+      yield hit.format(**fields)
+    else:
+      yield rand.choice(misses).format(**fields)
+
+
+def write(path, kind, count, hit_ratio, seed=0):
+  """ Write a :kind: log of :count: lines to :path:, and return
+  its size in bytes """
+  size = 0
+  with open(path, 'w') as fout:
+    for line in lines(kind, count, hit_ratio, seed):
+      fout.write(line)
+      size += len(line)
+  return size
+
+
+def main():
+  args = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  args.add_argument('kind', choices=sorted(KINDS))
+  args.add_argument('--lines', type=int, default=100000)
+  args.add_argument('--hit-ratio', type=float, default=0.05)
+  args.add_argument('--seed', type=int, default=0)
+  args.add_argument('-o', required=True, metavar='OUTPUT')
+  args = args.parse_args()
+
+  size = write(args.o, args.kind, args.lines, args.hit_ratio, args.seed)
+  print("{0} lines, {1:.1f} MB".format(args.lines, size / 1e6))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,74 @@
+""" Compare the cost of the two ways a parser can report
+that a line doesn't match: raising ValueError, or returning
+None from `match'.
+
+    $ python benchmarks/miss_path.py --lines 200000 --hit-ratio 0.01
+"""
+import argparse
+import random
+import timeit
+
+import yaml
+from pkg_resources import resource_stream
+
+from logparser.parsers import matcher
+from logparser.parsers.pingbound import PingBound
+from logparser.parsers.simpleregex import SimpleRegex
+
+MISS = "Aug 21 18:05:{0:02d} host.local cron[1]: (root) CMD (run-parts)\n"
+AUTH = ("Aug 21 18:05:{0:02d} host.local sshd[123]: Failed password "
+        "for root from 10.0.0.{0} port 22\n")
+PING = ("Aug 21 18:05:{0:02d}.123 [PingBound] Passed. "
+        "[lbound: 1.0, ubound: 2.0, latency: 1.5]\n")
+
+
+def corpus(lines, hit_ratio, seed=0):
+  """ Build a list of :lines: log lines, of which about
+  :hit_ratio: match one of the parsers """
+  rand = random.Random(seed)
+  out = []
+  for i in xrange(lines):
+    if rand.random() < hit_ratio:
+      out.append(rand.choice((AUTH, PING)).format(i % 60))
+    else:
+      out.append(MISS.format(i % 60))
+  return out
+
+
+def raising(parser, lines):
+  for line in lines:
+    try:
+      parser(line)
+    except ValueError:
+      pass
+
+
+def returning(parser, lines):
+  for line in lines:
+    parser(line)
+
+
+def main():
+  args = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  args.add_argument('--lines', type=int, default=100000)
+  args.add_argument('--hit-ratio', type=float, default=0.01)
+  args.add_argument('--repeat', type=int, default=3)
+  args = args.parse_args()
+
+  with resource_stream('logparser.parsers', 'simple/example.yml') as fin:
+    name, runner = SimpleRegex.Load(yaml.load(fin)[0])
+
+  lines = corpus(args.lines, args.hit_ratio)
+  print("{0} lines, {1:.1%} matching".format(args.lines, args.hit_ratio))
+
+  for name, parser in ((name, runner), ('pingbound', PingBound)):
+    paths = (('ValueError', lambda: raising(parser, lines)),
+             ('match', lambda: returning(matcher(parser), lines)))
+
+    for path, fn in paths:
+      best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+      print("{0:16} {1:12} {2:8.3f}s {3:8.0f} ns/line"
+            .format(name, path, best, best / args.lines * 1e9))
+
+if __name__ == '__main__':
+  main()
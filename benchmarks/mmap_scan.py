@@ -0,0 +1,47 @@
+""" Compare parsing a file line by line with scanning it
+through a memory map (`parse --mmap').
+
+    $ python benchmarks/mmap_scan.py --lines 1000000 --hit-ratio 0.001
+"""
+import argparse
+import os
+import tempfile
+import timeit
+
+import yaml
+from pkg_resources import resource_stream
+
+from logparser.core import parse_file
+from logparser.parsers.simpleregex import SimpleRegex
+
+from miss_path import corpus
+
+
+def main():
+  args = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  args.add_argument('--lines', type=int, default=500000)
+  args.add_argument('--hit-ratio', type=float, default=0.01)
+  args.add_argument('--repeat', type=int, default=3)
+  args = args.parse_args()
+
+  with resource_stream('logparser.parsers', 'simple/example.yml') as fin:
+    name, runner = SimpleRegex.Load(yaml.load(fin)[0])
+  parsers = {name: runner}
+
+  fd, path = tempfile.mkstemp(suffix='.log')
+  try:
+    with os.fdopen(fd, 'w') as fout:
+      fout.writelines(corpus(args.lines, args.hit_ratio))
+    print("{0} lines, {1:.1%} matching".format(args.lines, args.hit_ratio))
+
+    for mode, scan in (('lines', False), ('mmap', True)):
+      fn = lambda: parse_file('bench', path, parsers, show_progress=False,
+                              scan=scan)
+      best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+      print("{0:8} {1:8.3f}s {2:8.0f} ns/line"
+            .format(mode, best, best / args.lines * 1e9))
+  finally:
+    os.remove(path)
+
+if __name__ == '__main__':
+  main()
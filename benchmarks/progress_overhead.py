@@ -0,0 +1,78 @@
+""" Measure what progress reporting costs per line.
+
+Compares calling `bar.update(ctr)' for every line, as parse_file
+used to, with updating once per block of lines and with no
+progress reporting at all.
+
+    $ python benchmarks/progress_overhead.py --lines 1000000
+"""
+import argparse
+import itertools
+import os
+import timeit
+
+import progressbar
+
+LINE = "Aug 21 18:05:05 host.local cron[1]: (root) CMD (run-parts)\n"
+BLOCK = 1000
+
+
+def make_bar(maxval):
+  return progressbar.ProgressBar(maxval=maxval, fd=open(os.devnull, 'w'),
+                                 widgets=[progressbar.Bar('=', '[', ']'),
+                                          ' ', progressbar.Percentage()])
+
+
+def per_line(lines):
+  bar = make_bar(len(lines))
+  bar.start()
+  ctr = 0
+  for line in lines:
+    if ctr <= len(lines):
+      bar.update(ctr)
+    ctr += 1
+  bar.finish()
+
+
+def per_block(lines):
+  bar = make_bar(sum(itertools.imap(len, lines)))
+  bar.start()
+  it = iter(lines)
+  pos = 0
+  while True:
+    block = [line for line in itertools.islice(it, BLOCK)]
+    if not block:
+      break
+    pos += sum(itertools.imap(len, block))
+    for line in block:
+      pass
+    bar.update(pos)
+  bar.finish()
+
+
+def none(lines):
+  for line in lines:
+    pass
+
+
+def main():
+  args = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  args.add_argument('--lines', type=int, default=500000)
+  args.add_argument('--repeat', type=int, default=3)
+  args = args.parse_args()
+
+  lines = [LINE] * args.lines
+  results = []
+  for name, fn in (('none', none), ('per block', per_block),
+                   ('per line', per_line)):
+    best = min(timeit.repeat(lambda: fn(lines), number=1,
+                             repeat=args.repeat))
+    results.append((name, best))
+
+  baseline = results[0][1]
+  for name, best in results:
+    print("{0:10} {1:8.3f}s {2:8.1f} ns/line overhead"
+          .format(name, best, (best - baseline) / args.lines * 1e9))
+
+if __name__ == '__main__':
+  main()
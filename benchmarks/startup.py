@@ -0,0 +1,64 @@
+""" Measure how long the logparser command takes to start.
+
+Runs `logparser list parsers' and a parse of a one line log in
+fresh interpreters, first with an empty parser registry and then
+with the registry the first run left behind.
+
+    $ python benchmarks/startup.py --repeat 10
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+LINE = ("Aug 21 18:05:05 host.local sshd[123]: Failed password "
+        "for root from 10.0.0.1 port 22\n")
+
+
+def command(*args):
+  return [sys.executable, '-m', 'logparser.cmdline'] + [str(a) for a in args]
+
+
+def run(cmd, env):
+  with open(os.devnull, 'w') as null:
+    subprocess.check_call(cmd, env=env, stdout=null, stderr=null)
+
+
+def main():
+  args = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  args.add_argument('--repeat', type=int, default=5)
+  args = args.parse_args()
+
+  tmp = tempfile.mkdtemp()
+  try:
+    logdir = os.path.join(tmp, 'logs')
+    os.makedirs(logdir)
+    with open(os.path.join(logdir, 'auth.log'), 'w') as fout:
+      fout.write(LINE)
+
+    cache = os.path.join(tmp, 'cache')
+    env = dict(os.environ, LOGPARSER_CACHE_DIR=cache)
+    commands = (
+        ('python', [sys.executable, '-c', 'pass']),
+        ('list parsers', command('list', 'parsers')),
+        ('parse', command('parse', '--no-progress', '-p', 'failed_attempts',
+                          '-o', os.path.join(tmp, 'out.json'), logdir,
+                          'auth.log')))
+
+    for name, cmd in commands:
+      cold = []
+      for _ in xrange(args.repeat):
+        shutil.rmtree(cache, ignore_errors=True)
+        cold.append(timeit.timeit(lambda: run(cmd, env), number=1))
+      warm = timeit.repeat(lambda: run(cmd, env), number=1,
+                           repeat=args.repeat)
+      print("{0:14} cold {1:7.1f}ms   warm {2:7.1f}ms"
+            .format(name, min(cold) * 1e3, min(warm) * 1e3))
+  finally:
+    shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,226 @@
+""" Benchmark parse, flatten and DataFrame building on synthetic
+logs (see corpus.py), and compare the results with an earlier run.
+
+Each stage runs in a fresh process, so that its peak RSS is its
+own:
+
+  parse       parse_file, line by line
+  parse-mmap  parse_file with the log memory-mapped (`parse --mmap')
+  write       writing the parsed records as JSON
+  dataframe   loading that JSON and building a DataFrame from it
+  flatten     reading that JSON back as text rows (`flatten')
+
+    $ python benchmarks/suite.py --lines 1000000 --save before.json
+    ... change something ...
+    $ python benchmarks/suite.py --lines 1000000 --compare before.json
+
+Two saved runs can also be compared without running anything:
+
+    $ python benchmarks/suite.py --results after.json --compare before.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+import corpus
+
+# The log each case parses, and the parser it uses.
+CASES = (
+    ('auth', 'auth.log', 'failed_attempts'),
+    ('pingbound', 'tor.log', 'pingbound-old')
+)
+
+STAGES = ('parse', 'parse-mmap', 'write', 'dataframe', 'flatten')
+
+
+def _parsers(name):
+  from logparser.core import load_parsers
+  return load_parsers(argparse.Namespace(parser_opts={}), [name])
+
+
+def _parse(log, parser, scan=False):
+  from logparser.core import parse_file
+  return parse_file(os.path.basename(log), log, _parsers(parser),
+                    show_progress=False, scan=scan)
+
+
+def _dataframe(output, parser):
+  from logparser.postprocess.util import load_dataframe
+  return load_dataframe(output, '*', parser, label_files=True)
+
+
+def run_stage(stage, log, output, parser):
+  """ Run :stage: in this process, and return (seconds, units,
+  bytes), where :units: and :bytes: are how many lines or
+  records, and how much data, it got through """
+  lines = sum(1 for _ in open(log))
+
+  if stage in ('parse', 'parse-mmap'):
+    timer = timeit.default_timer()
+    _parse(log, parser, scan=stage == 'parse-mmap')
+    return timeit.default_timer() - timer, lines, os.path.getsize(log)
+
+  if stage == 'write':
+    from logparser.output import JSONWriter
+    data = _parse(log, parser)
+    writer = JSONWriter(output, [parser])
+    writer.file(os.path.basename(log), [parser]).update(data)
+
+    timer = timeit.default_timer()
+    writer.close()
+    return (timeit.default_timer() - timer, len(data[parser]),
+            os.path.getsize(output))
+
+  if stage == 'dataframe':
+    timer = timeit.default_timer()
+    frame = _dataframe(output, parser)
+    return timeit.default_timer() - timer, len(frame), os.path.getsize(output)
+
+  if stage == 'flatten':
+    from logparser.postprocess.manip import flat_rows
+    rows = size = 0
+    timer = timeit.default_timer()
+    with open(os.devnull, 'w') as fout:
+      for row in flat_rows(output, '*', parser):
+        text = " ".join(row) + "\n"
+        fout.write(text)
+        size += len(text)
+        rows += 1
+    # The first row is the headers
+    return timeit.default_timer() - timer, rows - 1, size
+
+  raise ValueError("Unknown stage '{0}'".format(stage))
+
+
+def _child(queue, stage, log, output, parser):
+  try:
+    seconds, units, size = run_stage(stage, log, output, parser)
+  except Exception as e:
+    queue.put(('error', repr(e)))
+    return
+  # ru_maxrss is in kilobytes on Linux
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  queue.put(('ok', (seconds, units, size, rss)))
+
+
+def measure(stage, log, output, parser, repeat):
+  """ Run :stage: :repeat: times, each in a new process, and
+  return the fastest time along with the largest peak RSS """
+  best = None
+  peak = 0.0
+  for _ in xrange(repeat):
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_child,
+                                    args=(queue, stage, log, output, parser))
+    child.start()
+    status, result = queue.get()
+    child.join()
+    if status != 'ok':
+      raise RuntimeError("{0} failed: {1}".format(stage, result))
+
+    seconds, units, size, rss = result
+    peak = max(peak, rss)
+    if best is None or seconds < best[0]:
+      best = (seconds, units, size)
+
+  seconds, units, size = best
+  return {
+      'seconds': seconds,
+      'units': units,
+      'units_per_sec': units / seconds if seconds else 0.0,
+      'mb_per_sec': size / 1e6 / seconds if seconds else 0.0,
+      'peak_rss_mb': peak
+  }
+
+
+def run(args):
+  tmp = tempfile.mkdtemp()
+  try:
+    results = {}
+    for case, filename, parser in CASES:
+      log = os.path.join(tmp, filename)
+      output = os.path.join(tmp, case + '.json')
+      corpus.write(log, case, args.lines, args.hit_ratio, args.seed)
+
+      for stage in STAGES:
+        key = '{0}/{1}'.format(case, stage)
+        results[key] = measure(stage, log, output, parser, args.repeat)
+        report_line(key, results[key])
+    return results
+  finally:
+    shutil.rmtree(tmp)
+
+
+def report_line(key, result):
+  print("{0:22} {1:9.3f}s {2:12,.0f}/s {3:8.1f} MB/s {4:8.1f} MB RSS"
+        .format(key, result['seconds'], result['units_per_sec'],
+                result['mb_per_sec'], result['peak_rss_mb']))
+
+
+def compare(results, baseline):
+  """ Print how each of :results: changed since :baseline: """
+  print("\n{0:22} {1:>10} {2:>10} {3:>8} {4:>10} {5:>10}"
+        .format('', 'before', 'after', 'time', 'RSS before', 'RSS after'))
+  for key in sorted(results):
+    if key not in baseline:
+      continue
+    old, new = baseline[key], results[key]
+    ratio = new['seconds'] / old['seconds'] if old['seconds'] else 0.0
+    print("{0:22} {1:9.3f}s {2:9.3f}s {3:7.2f}x {4:7.1f} MB {5:7.1f} MB"
+          .format(key, old['seconds'], new['seconds'], ratio,
+                  old['peak_rss_mb'], new['peak_rss_mb']))
+
+
+def load(path):
+  with open(path) as fin:
+    return json.load(fin)
+
+
+def main():
+  args = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  args.add_argument('--lines', type=int, default=200000)
+  args.add_argument('--hit-ratio', type=float, default=0.05)
+  args.add_argument('--seed', type=int, default=0)
+  args.add_argument('--repeat', type=int, default=3)
+  args.add_argument('--save', metavar='PATH',
+                    help="Save the results as JSON to PATH")
+  args.add_argument('--compare', metavar='PATH',
+                    help="Compare the results with those saved in PATH")
+  args.add_argument('--results', metavar='PATH',
+                    help="Don't run anything, and use the results saved "
+                         "in PATH instead")
+  args = args.parse_args()
+
+  settings = {'lines': args.lines, 'hit_ratio': args.hit_ratio,
+              'seed': args.seed, 'repeat': args.repeat}
+  if args.results:
+    saved = load(args.results)
+    settings, results = saved['settings'], saved['results']
+  else:
+    print("{0} lines per log, {1:.1%} matching".format(args.lines,
+                                                       args.hit_ratio))
+    results = run(args)
+
+  if args.save:
+    with open(args.save, 'w') as fout:
+      json.dump({'version': 1, 'settings': settings, 'results': results,
+                 'python': sys.version.split()[0],
+                 'machine': platform.platform()},
+                fout, indent=2, sort_keys=True)
+
+  if args.compare:
+    baseline = load(args.compare)
+    if baseline['settings'] != settings:
+      print("Warning: the runs used different settings: {0} and {1}"
+            .format(baseline['settings'], settings))
+    compare(results, baseline['results'])
+
+if __name__ == '__main__':
+  main()
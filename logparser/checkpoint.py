@@ -0,0 +1,121 @@
+""" Bookkeeping for incremental parsing.
+
+A checkpoint index sits next to the output of `parse' and
+records, for every log file, how far it has been parsed and
+what the file looked like at that point. A later run can then
+parse only what has been appended since. Files which have been
+rotated, truncated or rewritten, or which were parsed with
+different parser definitions, are parsed again from the start.
+"""
+import os
+import json
+import hashlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+# How many bytes before the checkpoint are hashed to make sure
+# that the start of the file hasn't been rewritten.
+CHECKSUM_BYTES = 4096
+
+
+def last_line_end(path, size=None):
+  """ Return the offset just past the last newline in
+  :path:, so that a line which is still being written isn't
+  parsed until it is complete. """
+  if size is None:
+    size = os.path.getsize(path)
+
+  with open(path) as fin:
+    pos = size
+    while pos > 0:
+      step = min(pos, 65536)
+      fin.seek(pos - step)
+      block = fin.read(step)
+      newline = block.rfind('\n')
+      if newline >= 0:
+        return pos - step + newline + 1
+      pos -= step
+
+  return 0
+
+
+def checksum(path, offset):
+  """ Hash the CHECKSUM_BYTES of :path: which come before
+  :offset: """
+  start = max(0, offset - CHECKSUM_BYTES)
+  with open(path) as fin:
+    fin.seek(start)
+    return hashlib.sha1(fin.read(offset - start)).hexdigest()
+
+
+class CheckpointIndex(object):
+  """ The per-file checkpoints for one output file, stored
+  as JSON in :path:. Only the files updated during a run are
+  kept when it is saved, so those which have gone away are
+  forgotten. """
+
+  def __init__(self, path):
+    self.path = path
+    self.files = {}
+    self.updated = set()
+
+    if os.path.exists(path):
+      try:
+        with open(path) as fin:
+          self.files = json.load(fin)['files']
+      except (IOError, ValueError, KeyError) as e:
+        logger.warn("Ignoring unreadable checkpoint index '{0}'"
+                    .format(path))
+        logger.debug("Index Error: {0}".format(e))
+
+  def resume_offset(self, identifier, path, signatures):
+    """ Return the offset parsing :path: should resume from,
+    or 0 if it has to be parsed from the start.
+
+    :signatures: maps the names of the parsers in use to their
+    signatures (see logparser.parsers.signature).
+    """
+    entry = self.files.get(identifier)
+    if entry is None:
+      return 0
+
+    stat = os.stat(path)
+    if entry['parsers'] != signatures:
+      logger.info("Parsers changed since '{0}' was parsed. Starting over."
+                  .format(identifier))
+    elif entry['inode'] != stat.st_ino:
+      logger.info("'{0}' has been rotated. Starting over."
+                  .format(identifier))
+    elif stat.st_size < entry['offset']:
+      logger.info("'{0}' has been truncated. Starting over."
+                  .format(identifier))
+    elif checksum(path, entry['offset']) != entry['checksum']:
+      logger.info("'{0}' has been rewritten. Starting over."
+                  .format(identifier))
+    else:
+      return entry['offset']
+
+    return 0
+
+  def update(self, identifier, path, offset, signatures):
+    """ Record that :path: has been parsed up to :offset: """
+    self.updated.add(identifier)
+    self.files[identifier] = {
+        'inode': os.stat(path).st_ino,
+        'offset': offset,
+        'checksum': checksum(path, offset),
+        'parsers': signatures
+    }
+
+  def save(self):
+    """ Write the checkpoints of the files updated since the
+    index was read """
+    files = dict((identifier, entry)
+                 for identifier, entry in self.files.iteritems()
+                 if identifier in self.updated)
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as fout:
+      json.dump({'version': 1, 'files': files}, fout, indent=2,
+                sort_keys=True)
+    os.rename(tmp, self.path)
@@ -1,8 +1,6 @@
 import argparse
 import sys
-import core
 import string
-import postprocess.manip
 
 
 def run_postprocess_plot(args):
@@ -12,6 +10,34 @@ def run_postprocess_plot(args):
   postprocess.plot.plot(args)
 
 
+# The commands import what they need when they are run, so
+# that starting up doesn't pay for all of them.
+
+def run_parse(args):
+  import core
+  core.parse(args)
+
+
+def run_list(args):
+  import core
+  core.list(args)
+
+
+def run_follow(args):
+  import follow
+  follow.follow(args)
+
+
+def run_flatten(args):
+  import postprocess.manip
+  postprocess.manip.flatten(args)
+
+
+def run_aggregate(args):
+  import postprocess.aggregate
+  postprocess.aggregate.aggregate(args)
+
+
 def setup_logging():
   import logging
   logger = logging.getLogger()
@@ -42,6 +68,15 @@ def add_parser_args(subp):
                                  "or more parsers")
   parse_p.add_argument("-o", help="Output filename",
                        metavar="OUTPUT", required=True)
+  parse_p.add_argument("--format",
+                       choices=['json', 'jsonl', 'columnar', 'indexed'],
+                       default='json',
+                       help="Write a single JSON document, one JSON "
+                            "line per record as soon as it is parsed, "
+                            "a directory of typed NumPy column arrays, "
+                            "or JSON lines grouped by file and parser "
+                            "with an index of where each group is "
+                            "(default: json)")
 
   parse_p.add_argument("-p", "--parsers", action='append',
                        help="The parsers to use. Will search for them in"
@@ -56,18 +91,130 @@ def add_parser_args(subp):
   parse_p.add_argument('--visual', help='Show visually which lines are parsed',
                        action='store_true')
 
+  parse_p.add_argument('--incremental', action='store_true',
+                       help="Only parse what has been appended to each file "
+                            "since the last run, and add it to the existing "
+                            "output. Progress is kept in OUTPUT.idx")
+
+  parse_p.add_argument('--no-progress', action='store_true',
+                       help="Don't show a progressbar")
+
+  parse_p.add_argument('--stats', action='store_true',
+                       help="Count and time what each parser does, and "
+                            "report it at the end. Also written to "
+                            "OUTPUT.stats.json")
+
+  parse_p.add_argument('--mmap', action='store_true',
+                       help="Memory-map plain log files and search them "
+                            "directly, rather than reading them line by "
+                            "line. Much faster when few lines match.")
+
+  parse_p.add_argument('-j', '--jobs', type=int, default=1,
+                       help="Parse files in this many worker processes")
+  parse_p.add_argument('--chunk_size', type=int, default=64, metavar='MB',
+                       help="When using more than one job, split files "
+                            "larger than this into separately parsed "
+                            "chunks. 0 disables splitting.")
+
+  parse_p.add_argument('--pipeline', action='store_true',
+                       help="With one job, read, parse and write in "
+                            "separate threads, reading several files at "
+                            "once. Helps when reading or writing is slow.")
+  parse_p.add_argument('--readers', type=int, default=4,
+                       help="How many files to read at once with "
+                            "--pipeline")
+
+  parse_p.add_argument('--regex', action='store_true',
+                       help="Treat lognames as regular expressions rather "
+                            "than shell-style globs")
+  parse_p.add_argument('--include_dir', action='append', default=[],
+                       metavar='GLOB',
+                       help="Only parse logs below directories matching "
+                            "GLOB. May be given more than once.")
+  parse_p.add_argument('--exclude_dir', action='append', default=[],
+                       metavar='GLOB',
+                       help="Don't look in directories matching GLOB. May "
+                            "be given more than once.")
+  parse_p.add_argument('--discovery_threads', type=int, default=8,
+                       help="How many directories to list at once while "
+                            "looking for logs")
+
   parse_p.add_argument('logdir',
                        help="A directory from which to search for logfiles")
   parse_p.add_argument('lognames', nargs='+',
-                       help="Names which should be considered log files",
+                       help="Names which should be considered log files. "
+                            "Globs such as 'tor-*.log' are allowed. "
+                            "Rotated and compressed copies such as "
+                            "NAME.1 and NAME.2.gz are included.",
                        default=['log'])
-  parse_p.set_defaults(func=core.parse)
+  parse_p.set_defaults(func=run_parse)
+
+
+def add_follow_args(subp):
+  follow_p = subp.add_parser('follow',
+                             help="Keep parsing lines as they are appended "
+                                  "to a set of files")
+  output = follow_p.add_mutually_exclusive_group(required=True)
+  output.add_argument("-o", metavar="OUTPUT",
+                      help="Append records to this file as JSON lines")
+  output.add_argument("--socket", metavar="PATH",
+                      help="Send records as JSON lines to every client "
+                           "connected to a Unix socket at PATH")
+
+  follow_p.add_argument("-p", "--parsers", action='append', required=True,
+                        help="The parsers to use")
+  follow_p.add_argument('--parser_opts', action=ParserOptsAction,
+                        help="Any parser specific options in "
+                             "'parser_name.option=value' "
+                             "syntax.",
+                        default={})
+
+  follow_p.add_argument('--from_start', action='store_true',
+                        help="Parse files which already exist from the "
+                             "start, rather than only what is appended")
+  follow_p.add_argument('--poll', action='store_true',
+                        help="Poll for changes even if inotify is available")
+  follow_p.add_argument('--poll_interval', type=float, default=0.25,
+                        metavar='SECONDS',
+                        help="How often to check files when polling")
+  follow_p.add_argument('--rescan', type=float, default=10,
+                        metavar='SECONDS',
+                        help="How often to look for new files")
+  follow_p.add_argument('--stats_interval', type=float, default=60,
+                        metavar='SECONDS',
+                        help="How often to report how many lines were "
+                             "parsed and how long they took from being "
+                             "read to being emitted")
+
+  follow_p.add_argument('--regex', action='store_true',
+                        help="Treat lognames as regular expressions rather "
+                             "than shell-style globs")
+  follow_p.add_argument('--include_dir', action='append', default=[],
+                        metavar='GLOB',
+                        help="Only follow logs below directories matching "
+                             "GLOB. May be given more than once.")
+  follow_p.add_argument('--exclude_dir', action='append', default=[],
+                        metavar='GLOB',
+                        help="Don't look in directories matching GLOB. May "
+                             "be given more than once.")
+  follow_p.add_argument('--discovery_threads', type=int, default=8,
+                        help="How many directories to list at once while "
+                             "looking for logs")
+
+  follow_p.add_argument('logdir',
+                        help="A directory from which to search for logfiles")
+  follow_p.add_argument('lognames', nargs='+',
+                        help="Names which should be considered log files. "
+                             "Globs such as 'tor-*.log' are allowed.")
+  follow_p.set_defaults(func=run_follow)
 
 
 def add_list_args(subp):
   parser = subp.add_parser('list', help="List system information")
-  parser.add_argument('infotype', choices=['parsers'],
+  parser.add_argument('infotype', choices=['parsers', 'contents'],
                       help="Information to list")
+  parser.add_argument('input', nargs='?',
+                      help="For 'contents', a file output by 'parse'")
 
   parser.add_argument('--parser_opts', action=ParserOptsAction,
                       help="Any parser specific options in "
@@ -75,7 +222,7 @@ def add_list_args(subp):
                            "syntax.",
                       default={})
 
-  parser.set_defaults(func=core.list)
+  parser.set_defaults(func=run_list)
 
 
 def add_graph_args(subp):
@@ -126,7 +273,55 @@ def add_flatten_args(subp):
   parser.add_argument('input',
                       help="A file output by 'parse'")
 
-  parser.set_defaults(func=postprocess.manip.flatten)
+  parser.set_defaults(func=run_flatten)
+
+
+def add_aggregate_args(subp):
+  parser = subp.add_parser('aggregate',
+                           help="Compute counts, sums, means, extremes and "
+                                "quantiles of parsed data, grouped by file "
+                                "or by other columns.")
+
+  parser.add_argument('-p',
+                      help="Aggregate data from this parser. If not "
+                           "provided it will take the first one seen.",
+                      default=None)
+  parser.add_argument('-f',
+                      help="Filter files to include. '*' will "
+                           "glob like the shell",
+                      default='*')
+  parser.add_argument('-c', '--column', action='append',
+                      help="A column to aggregate. May be given more than "
+                           "once. Defaults to every numeric column other "
+                           "than timestamps.")
+  parser.add_argument('-b', '--by', action='append',
+                      help="A column to group by. May be given more than "
+                           "once. 'file_' groups by parsed file, and '' "
+                           "puts everything in one group (default: file_)")
+  parser.add_argument('-a', '--aggregates', action='append',
+                      choices=['count', 'sum', 'mean', 'min', 'max'],
+                      help="An aggregate to compute. May be given more "
+                           "than once (default: all of them)")
+  parser.add_argument('-q', '--quantile', action='append', type=float,
+                      help="A quantile to estimate, such as 0.99. May be "
+                           "given more than once (default: 0.5, 0.9 and "
+                           "0.99)")
+  parser.add_argument('--accuracy', type=float, default=0.01,
+                      help="The relative error allowed in quantiles "
+                           "(default: 0.01)")
+  parser.add_argument('-j', '--jobs', type=int, default=None,
+                      help="How many processes to aggregate in "
+                           "(default: one per CPU)")
+  parser.add_argument('--parser_opts', action=ParserOptsAction,
+                      help="Any parser specific options in "
+                           "'parser_name.option=value' "
+                           "syntax, used to find the types of "
+                           "the parser's fields.",
+                      default={})
+  parser.add_argument('input',
+                      help="A file output by 'parse'")
+
+  parser.set_defaults(func=run_aggregate)
 
 
 def script_run():
@@ -134,8 +329,10 @@ def script_run():
   subp = parser.add_subparsers()
 
   add_parser_args(subp)
+  add_follow_args(subp)
   add_list_args(subp)
   add_flatten_args(subp)
+  add_aggregate_args(subp)
   add_graph_args(subp)
 
   args = parser.parse_args()
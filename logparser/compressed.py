@@ -0,0 +1,300 @@
+""" Reading compressed log files.
+
+Rotated logs are usually compressed. The format is detected from
+the first bytes of the file, and the file is decompressed in a
+background thread while the lines already decompressed are being
+parsed. gzip, bz2 and xz are decompressed without holding the
+interpreter lock, so the two really do overlap.
+
+gzip files made of several members (as produced by `cat a.gz
+b.gz', or by compressing a log in pieces) can be split at member
+boundaries and decompressed in parallel. Member boundaries can only
+be guessed from the gzip magic number, so every member's CRC is
+checked and a guess which turns out to be inside a member is
+thrown away by the caller (see logparser.core).
+"""
+import os
+import bz2
+import zlib
+import Queue
+import threading
+import cStringIO
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Bytes of compressed data read at a time.
+READ_SIZE = 1024 * 1024
+
+# Decompressed blocks which may wait to be parsed before the
+# decompressing thread has to wait.
+QUEUE_BLOCKS = 8
+
+GZIP_MEMBER = '\x1f\x8b\x08'
+
+# bzip2 streams start with "BZh", their block size (1 to 9),
+# and the magic of their first block, or of their end if they
+# are empty. Plain text could well start with "BZh" and a digit.
+MAGIC = (
+    ('\x1f\x8b', 'gzip'),
+    ('\xfd7zXZ\x00', 'xz'),
+    ('\x28\xb5\x2f\xfd', 'zstd')
+) + tuple(('BZh' + level + block, 'bz2') for level in '123456789'
+          for block in ('1AY&SY', '\x17rE8P\x90'))
+
+EXTENSIONS = ('.gz', '.bz2', '.xz', '.zst')
+
+
+def detect(path):
+  """ Return the compression format of :path: (one of 'gzip',
+  'bz2', 'xz' or 'zstd'), or None if it isn't compressed """
+  with open(path, 'rb') as fin:
+    head = fin.read(max(len(magic) for magic, _ in MAGIC))
+
+  for magic, kind in MAGIC:
+    if head.startswith(magic):
+      return kind
+  return None
+
+
+def _gzip():
+  return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _bz2():
+  return bz2.BZ2Decompressor()
+
+
+def _xz():
+  try:
+    import lzma
+  except ImportError:
+    try:
+      from backports import lzma
+    except ImportError as e:
+      logger.error("Reading xz compressed logs requires lzma "
+                   "(backports.lzma on Python 2)")
+      logger.debug("ImportError: {0}".format(e))
+      raise RuntimeError()
+  return lzma.LZMADecompressor()
+
+
+def _zstd():
+  try:
+    import zstandard
+  except ImportError as e:
+    logger.error("Reading zstd compressed logs requires zstandard")
+    logger.debug("ImportError: {0}".format(e))
+    raise RuntimeError()
+  return zstandard.ZstdDecompressor().decompressobj()
+
+
+DECOMPRESSORS = {
+    'gzip': _gzip,
+    'bz2': _bz2,
+    'xz': _xz,
+    'zstd': _zstd
+}
+
+# Errors a decompressor raises for data it can't make sense of
+ERRORS = (zlib.error, IOError, EOFError, ValueError)
+
+
+def _finished(decompressor):
+  """ Check whether :decompressor: has reached the end of
+  its stream. Not every decompressor has an `eof' attribute,
+  but all of them put data past the end into `unused_data'. """
+  eof = getattr(decompressor, 'eof', None)
+  if eof is not None:
+    return eof
+  return bool(getattr(decompressor, 'unused_data', ''))
+
+
+def _complete(decompressor):
+  """ Check whether the stream fed to :decompressor: ended
+  properly, once the input has run out """
+  eof = getattr(decompressor, 'eof', None)
+  if eof is not None:
+    return eof
+
+  # Feed it one more byte and see if it is left over
+  probe = decompressor.copy() if hasattr(decompressor, 'copy') \
+      else decompressor
+  try:
+    probe.decompress('\x00')
+  except EOFError:
+    return True
+  except ERRORS:
+    return False
+  return bool(getattr(probe, 'unused_data', ''))
+
+
+def gzip_member_offsets(path, chunk_size, start=0, end=None):
+  """ Split the gzip file :path: into ranges of roughly
+  :chunk_size: compressed bytes, each starting at something
+  that looks like the start of a member.
+
+  Returns a list of (start, end) tuples.
+  """
+  size = os.path.getsize(path) if end is None else end
+  offsets = [start]
+  with open(path, 'rb') as fin:
+    target = start + chunk_size
+    while target < size:
+      fin.seek(target)
+      found = None
+      while found is None:
+        block = fin.read(READ_SIZE + len(GZIP_MEMBER) - 1)
+        if len(block) < len(GZIP_MEMBER):
+          break
+        pos = block.find(GZIP_MEMBER)
+        if pos >= 0:
+          found = fin.tell() - len(block) + pos
+        else:
+          fin.seek(-(len(GZIP_MEMBER) - 1), os.SEEK_CUR)
+
+      if found is None or found >= size:
+        break
+      offsets.append(found)
+      target = found + chunk_size
+
+  return zip(offsets, offsets[1:] + [size])
+
+
+class CompressedReader(object):
+  """ Read lines from the compressed file :path:, decompressing
+  in a background thread.
+
+  Reading starts at the member beginning at byte :start: of
+  the compressed file. If :end: is given, reading stops after
+  the first member which ends at or past it; otherwise it
+  carries on to the end of the file.
+
+  Once read, `members' lists the (start, end) offsets of each
+  member decompressed, `newline' says whether the text ended
+  with a newline (None if there wasn't any text) and
+  `truncated' whether the last member was cut short.
+  """
+
+  def __init__(self, path, kind, start=0, end=None):
+    self.path = path
+    self.kind = kind
+    self.start = start
+    self.end = end
+    self.members = []
+    self.newline = None
+    self.truncated = False
+
+    self._new = DECOMPRESSORS[kind]
+    self._queue = Queue.Queue(QUEUE_BLOCKS)
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._decompress)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, item):
+    while not self._stop.is_set():
+      try:
+        self._queue.put(item, timeout=0.1)
+        return
+      except Queue.Full:
+        pass
+
+  def _decompress(self):
+    try:
+      self._run()
+    except Exception as e:
+      self._put(e)
+    else:
+      self._put(None)
+
+  def _run(self):
+    """ Decompress members and queue (offset, text) pairs,
+    where offset is how far through the compressed file the
+    text goes. """
+    decompressor = self._new()
+    member_start = pos = self.start
+    data = ''
+
+    with open(self.path, 'rb') as raw:
+      raw.seek(self.start)
+      while not self._stop.is_set():
+        if not data:
+          data = raw.read(READ_SIZE)
+          if not data:
+            break
+
+        try:
+          text = decompressor.decompress(data)
+          finished = _finished(decompressor)
+          unused = decompressor.unused_data if finished else ''
+        except EOFError:
+          # Python 2's bz2 only notices the end of a stream
+          # when it's given more data
+          text, finished, unused = '', True, data
+
+        used = len(data) - len(unused)
+        if text:
+          self._put((pos + used, text))
+
+        if not finished:
+          pos += len(data)
+          data = ''
+          continue
+
+        pos += used
+        self.members.append((member_start, pos))
+        if self.end is not None and pos >= self.end:
+          return
+
+        member_start = pos
+        decompressor = self._new()
+        data = unused
+        if data and not data.strip('\x00'):
+          # Some tools pad the end of the file with zeros
+          pos += len(data)
+          member_start = pos
+          data = ''
+
+      if pos > member_start:
+        self.truncated = not _complete(decompressor)
+        self.members.append((member_start, pos))
+
+  def blocks(self):
+    """ Yield (lines, consumed) pairs, where :consumed: is how
+    many compressed bytes the lines came from """
+    rest = ''
+    pos = last = self.start
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+      if isinstance(item, Exception):
+        raise item
+
+      pos, text = item
+      self.newline = False
+      cut = text.rfind('\n')
+      if cut < 0:
+        rest += text
+        continue
+
+      lines = cStringIO.StringIO(rest + text[:cut + 1]).readlines()
+      rest = text[cut + 1:]
+      yield lines, pos - last
+      last = pos
+
+    if self.newline is not None:
+      self.newline = not rest
+    if rest:
+      yield [rest], pos - last
+
+  def close(self):
+    self._stop.set()
+    self._thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
@@ -1,93 +1,534 @@
 import os.path
-from os.path import join as pathjoin
+import argparse
+import itertools
+import mmap
+import cStringIO
+import multiprocessing
 import progressbar
-import json
-from logparser.parsers import available_parsers
+from logparser.parsers import (ConversionError, available_parsers,
+                              describe_parsers, signature)
+from logparser.checkpoint import CheckpointIndex, last_line_end
+from logparser.discovery import LogMatcher, discover
+from logparser import compressed
+from logparser.dispatch import Dispatcher
+from logparser.stats import ParserStats, timer
+from logparser.output import WRITERS
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def filelen(fname, sample=10000):
+# How many lines are read and handed to the parsers at a time,
+# and so between progress updates.
+PROGRESS_INTERVAL = 1000
 
-  l = 0
-  with open(fname) as f:
+# How many bytes of a memory-mapped file are scanned between
+# progress updates.
+SCAN_WINDOW = 4 * 1024 * 1024
+
+
+def progress_bar(label, maxval):
+  return progressbar.ProgressBar(maxval=max(maxval, 1),
+                                 widgets=[
+                                     label,
+                                     progressbar.Bar('=', '[', ']'),
+                                     ' ',
+                                     progressbar.Percentage()
+                                 ])
+
+
+def chunk_offsets(path, chunk_size, start=0, end=None):
+  """ Split :path: into byte ranges of roughly :chunk_size:
+  bytes. Each range starts at the beginning of a line and ends
+  just after a newline (or at the end of the file).
+
+  If :start: or :end: are given, only split that part of
+  the file.
+
+  Returns a list of (start, end) tuples.
+  """
+  size = os.path.getsize(path) if end is None else end
+  offsets = [start]
+  with open(path) as fin:
+    while offsets[-1] + chunk_size < size:
+      fin.seek(offsets[-1] + chunk_size)
+      fin.readline()
+      if fin.tell() >= size:
+        break
+      offsets.append(fin.tell())
+
+  return zip(offsets, offsets[1:] + [size])
+
+
+def _plain_blocks(fin, start=0, end=None):
+  """ Yield blocks of up to PROGRESS_INTERVAL lines of :fin:
+  between :start: and :end:, with the number of bytes in each """
+  pos = start
+  fin.seek(start)
+  while end is None or pos < end:
+    block = [line for line in itertools.islice(fin, PROGRESS_INTERVAL)]
+    if not block:
+      break
+
+    read = sum(itertools.imap(len, block))
+    if end is not None and pos + read > end:
+      read = 0
+      for i, line in enumerate(block):
+        if pos + read >= end:
+          del block[i:]
+          break
+        read += len(line)
+
+    pos += read
+    yield block, read
+
+
+def scan_file(path, parsers, data, progress=None, start=0, end=None,
+              stats=None):
+  """ Parse the plain file :path: through a memory map.
+
+  Parsers with a `scan' attribute search the mapped file
+  directly, so lines they don't match are never copied out of
+  it. Any other parsers are given the lines as usual, as is a
+  scanning parser on a part of the file it fails to convert.
+  Records are appended to the lists in :data:, and parsers
+  are counted in :stats: if it is given.
+
+  Returns the number of bytes scanned.
+  """
+  scanners = []
+  others = {}
+  for name, parser in parsers.iteritems():
+    if getattr(parser, 'scan', None) is not None:
+      scanners.append((name, parser.scan))
+    else:
+      others[name] = parser
+  dispatch = Dispatcher(others, stats) if others else None
+  retry = Dispatcher(dict((name, parsers[name]) for name, _ in scanners),
+                     stats)
+
+  with open(path, 'rb') as fin:
+    size = os.fstat(fin.fileno()).st_size
+    end = size if end is None else min(end, size)
+    if end <= start:
+      return 0
+
+    buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
     try:
-      for i in xrange(sample):
-        s = next(f)
-        l += len(s)
-    except StopIteration:
-      pass
+      pos = start
+      while pos < end:
+        stop = end
+        if pos + SCAN_WINDOW < end:
+          stop = buf.find('\n', pos + SCAN_WINDOW, end) + 1 or end
+
+        for name, scan in scanners:
+          began = timer()
+          try:
+            found = [record for record in scan(buf, pos, stop)]
+          except ConversionError:
+            lines = cStringIO.StringIO(buf[pos:stop]).readlines()
+            found = [record for _, record in retry.each_line(name, lines)]
+          else:
+            if stats is not None:
+              stats.scanned(name, buf[pos:stop].count('\n'), len(found),
+                            timer() - began)
+          data[name].extend(found)
+        if dispatch is not None:
+          dispatch.block(cStringIO.StringIO(buf[pos:stop]).readlines(), data)
+
+        if progress is not None:
+          progress(stop - pos)
+        pos = stop
+    finally:
+      buf.close()
 
-  logger.debug("Calculated expected number of lines as {0}"
-               .format(os.path.getsize(fname) / (l / i)))
-  return os.path.getsize(fname) / (l / i)
+  return end - start
 
 
-def parse_file(identifier, path, parsers, highlight=False):
+def parse_file(identifier, path, parsers, highlight=False, progress=None,
+               start=0, end=None, data=None, show_progress=True, meta=None,
+               scan=False, stats=None):
   """ Apply each available parser to a file and return
   the processed output. If :highlight: is set, actually output
   the files with parsed lines highlighted.
+
+  Progress is measured in bytes of the file consumed. If
+  :progress: is given, it is called every PROGRESS_INTERVAL
+  lines with the number of bytes read since the last call
+  instead of drawing a progressbar for this file. If
+  :show_progress: is False, progress isn't tracked at all.
+
+  :start: and :end: restrict parsing to a byte range of the
+  file, as returned by chunk_offsets.
+
+  Compressed files are decompressed on the fly (see
+  logparser.compressed), and progress is measured in
+  compressed bytes. For these, :start: must be where a member
+  begins and parsing carries on to the end of the member that
+  :end: falls in. If :meta: is given, it is filled in with
+  where decompression stopped, whether the text ended with a
+  newline and whether the compressed data was complete.
+
+  If :scan: is set, plain files are memory-mapped and parsed
+  with scan_file, unless lines are to be highlighted.
+
+  If :stats: (a logparser.stats.ParserStats) is given, what
+  each parser costs is added to it.
+
+  Parsed records are appended to the lists in :data:, keyed by
+  parser name, if it is given (see logparser.output).
   """
 
-  lines = filelen(path)
-  bar = progressbar.ProgressBar(maxval=lines,
-                                widgets=[
-                                    '%s ' % identifier,
-                                    progressbar.Bar('=', '[', ']'),
-                                    ' ',
-                                    progressbar.Percentage()
-                                ])
+  bar = None
+  if progress is None and show_progress:
+    size = end if end is not None else os.path.getsize(path)
+    bar = progress_bar('%s ' % identifier, size - start)
+    progress = lambda count: bar.update(min(bar.currval + count,
+                                            bar.maxval))
 
-  data = dict()
-  with open(path) as fin:
-    bar.start()
+  if data is None:
+    data = dict((parser_name, []) for parser_name in parsers)
+
+  kind = compressed.detect(path)
+  if scan and kind is None and not highlight:
+    if bar is not None:
+      bar.start()
+    scanned = scan_file(path, parsers, data, progress, start, end, stats)
+    if bar is not None:
+      bar.finish()
+    logger.debug("Scanned {0} bytes total".format(scanned))
+
+    if start == 0 and end is None:
+      warn_empty(data)
+    return data
+
+  dispatch = Dispatcher(parsers, stats)
+  if kind is None:
+    source = open(path)
+    blocks = _plain_blocks(source, start, end)
+  else:
+    source = compressed.CompressedReader(path, kind, start, end)
+    blocks = source.blocks()
+
+  with source:
+    if bar is not None:
+      bar.start()
     ctr = 0
-    for line in fin:
-      if ctr <= lines:
-        bar.update(ctr)
-      ctr += 1
-
-      line_parsed = False
-      for parser_name, parser in parsers.iteritems():
-        if parser_name not in data:
-          data[parser_name] = []
-
-        try:
-          parsed = parser(line)
-          data[parser_name].append(parsed.data)
-          line_parsed = True
-        except ValueError:
-          pass
+
+    # Lines are read in blocks so that keeping track of
+    # progress costs nothing per line, and parsers which
+    # support it can parse a whole block at once.
+    for block, read in blocks:
+      ctr += len(block)
+      matched = dispatch.block(block, data)
 
       if highlight:
-        if line_parsed:
-          print("\033[92m{0}\033[0m".format(line.strip()))
-        else:
-          print("{0}".format(line.strip()))
+        for index, line in enumerate(block):
+          if index in matched:
+            print("\033[92m{0}\033[0m".format(line.strip()))
+          else:
+            print("{0}".format(line.strip()))
+
+      if progress is not None:
+        progress(read)
 
-  bar.finish()
+  if bar is not None:
+    bar.finish()
   logger.debug("Processed {0} lines total".format(ctr))
 
+  if kind is not None:
+    if meta is not None:
+      meta.update(stop=source.members[-1][1] if source.members else start,
+                  newline=source.newline, complete=not source.truncated)
+    elif source.truncated:
+      logger.warn("'{0}' ends part way through a compressed stream"
+                  .format(identifier))
+
+  if start == 0 and end is None:
+    warn_empty(data)
+
+  return data
+
+
+def warn_empty(data):
+  """ Warn about parsers which didn't find anything in
+  a file's parsed :data: """
   for parser, d in data.iteritems():
     if len(d) == 0:
       logger.warn("'{0}' parsed zero datapoints".format(parser))
 
-  return data
+
+# Per-process state for pool workers, set up by _init_worker.
+_worker_parsers = None
+_worker_counter = None
+_worker_scan = False
+_worker_stats = False
+
+
+def _add_progress(count):
+  """ Add :count: bytes to the progress counter shared
+  between all workers """
+  with _worker_counter.get_lock():
+    _worker_counter.value += count
+
+
+def _init_worker(parser_names, parser_opts, counter, scan=False, stats=False):
+  """ Set up a pool worker.
+
+  Parsers can't be pickled (the SimpleRegex runners are
+  generated classes), so each worker loads its own copy
+  by name.
+  """
+  global _worker_parsers, _worker_counter, _worker_scan, _worker_stats
+
+  opts = argparse.Namespace(parser_opts=parser_opts)
+  loaded = available_parsers(opts, parser_names)
+  _worker_parsers = dict((p, loaded[p]) for p in parser_names)
+  _worker_counter = counter
+  _worker_scan = scan
+  _worker_stats = stats
+
+
+def _parse_worker(job):
+  """ Parse a single file or chunk inside a pool worker.
+
+  Chunks of gzip files may not start at a member at all, so
+  errors decompressing them are reported back rather than
+  raised (see _join_members).
+
+  Returns (job, data, meta, stats), where :stats: is what the
+  parsers cost on this job if that is being measured.
+  """
+  identifier, path, start, end = job
+  progress = _add_progress if _worker_counter is not None else None
+  stats = ParserStats() if _worker_stats else None
+  meta = {}
+  try:
+    data = parse_file(identifier, path, _worker_parsers, progress=progress,
+                      start=start, end=end, show_progress=False, meta=meta,
+                      scan=_worker_scan, stats=stats)
+  except compressed.ERRORS as e:
+    if compressed.detect(path) != 'gzip':
+      raise
+    logger.debug("No gzip member at {0} of '{1}': {2}"
+                 .format(start, identifier, e))
+    return job, None, {'start': start, 'complete': False}, None
+
+  if meta:
+    meta['start'] = start
+  return job, data, meta or None, stats and stats.as_dict()
+
+
+def _join_members(joined, data, meta):
+  """ Add the :data: parsed from one chunk of a gzip file to
+  the records :joined: so far, if the chunk starts where the
+  last one stopped.
+
+  Chunks which start inside a member that has already been
+  read are ignored. A chunk which can't be read from where
+  it should start, or a line which runs across two chunks,
+  means the file has to be parsed again in one go.
+  """
+  if not joined['ok'] or meta['start'] != joined['pos']:
+    return
+
+  if not meta['complete'] or joined['newline'] is False:
+    joined['ok'] = False
+    return
+
+  for parser, d in data.iteritems():
+    joined['data'][parser].extend(d)
+  joined['pos'] = meta['stop']
+  if meta['newline'] is not None:
+    joined['newline'] = meta['newline']
+
+
+def _finish_file(current, writer, parser_names, parser_opts):
+  """ Hand the last of the records parsed from the file
+  described by :current: to :writer:, and mark it done """
+  identifier = current['identifier']
+  output = writer.file(identifier, parser_names)
+  end = current['end']
+
+  joined = current['joined']
+  if joined is not None:
+    # Chunks of a compressed file are put back together
+    # before anything is handed to the writer.
+    data = joined['data']
+    if not joined['ok'] or (end is not None and joined['pos'] < end):
+      logger.debug("Couldn't split '{0}' into gzip members. "
+                   "Parsing it in one go.".format(identifier))
+      opts = argparse.Namespace(parser_opts=parser_opts)
+      loaded = available_parsers(opts, parser_names)
+      parsers = dict((p, loaded[p]) for p in parser_names)
+      data = parse_file(identifier, current['path'], parsers,
+                        start=current['start'], end=end, show_progress=False)
+
+    for parser, d in data.iteritems():
+      output[parser].extend(d)
+
+  # Whole files have already been checked by the worker
+  if end is not None:
+    warn_empty(output)
+  writer.done(identifier)
+
+
+def parse_files_parallel(jobs, parser_names, parser_opts, processes, writer,
+                         show_progress=True, scan=False, stats=None):
+  """ Parse each (identifier, path, start, end) chunk in :jobs:
+  using a pool of :processes: workers. :end: may be None to
+  parse the whole file.
+
+  :jobs: may be any iterable, and is consumed as the workers
+  need more to do, so files can still be being found while
+  the first ones are parsed. Chunks of the same file must come
+  together and in order; their results are handed to :writer:
+  in line order as soon as they are available.
+
+  Progress of all workers is combined into a single
+  progressbar, unless :show_progress: is False. Its length
+  grows as more jobs are handed out. :scan: is passed on to
+  parse_file, and what each worker's parsers cost is added to
+  :stats: if it is given.
+  """
+  counter = None
+  if show_progress:
+    counter = multiprocessing.Value('L', 0)
+    bar = progress_bar('0 files ', 0)
+    seen = {'paths': set(), 'total': 0}
+
+    def counted(jobs):
+      for job in jobs:
+        _, path, start, end = job
+        seen['paths'].add(path)
+        seen['total'] += (os.path.getsize(path) if end is None
+                          else end) - start
+        yield job
+    jobs = counted(jobs)
+
+  pool = multiprocessing.Pool(processes, _init_worker,
+                              (parser_names, parser_opts, counter, scan,
+                               stats is not None))
+  try:
+    results = pool.imap(_parse_worker, jobs)
+    if show_progress:
+      bar.start()
+    current = None
+    while True:
+      try:
+        job, data, meta, job_stats = results.next(0.2)
+      except multiprocessing.TimeoutError:
+        if show_progress:
+          bar.widgets[0] = '{0} files '.format(len(seen['paths']))
+          bar.maxval = max(seen['total'], 1)
+          bar.update(min(counter.value, bar.maxval))
+        continue
+      except StopIteration:
+        break
+
+      if job_stats is not None:
+        stats.merge(job_stats)
+
+      identifier, path, start, end = job
+      if current is not None and current['identifier'] != identifier:
+        _finish_file(current, writer, parser_names, parser_opts)
+        current = None
+      if current is None:
+        current = {'identifier': identifier, 'path': path, 'start': start,
+                   'joined': None}
+      current['end'] = end
+
+      if meta is not None:
+        if current['joined'] is None:
+          current['joined'] = {'pos': start, 'newline': None, 'ok': True,
+                               'data': dict((p, []) for p in parser_names)}
+        _join_members(current['joined'], data, meta)
+      else:
+        output = writer.file(identifier, parser_names)
+        for parser, d in data.iteritems():
+          output[parser].extend(d)
+
+    if current is not None:
+      _finish_file(current, writer, parser_names, parser_opts)
+
+    if show_progress:
+      bar.widgets[0] = '{0} files '.format(len(seen['paths']))
+      bar.maxval = max(seen['total'], 1)
+      bar.finish()
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
+def plan_jobs(paths, logdir, writer, index=None, signatures=None,
+              resume=True, chunk_size=0):
+  """ Turn each log file in :paths: into (identifier, path,
+  start, end) jobs for parse_file, as it arrives.
+
+  If a CheckpointIndex :index: is given, each file is only
+  parsed from where the last run stopped (unless :resume: is
+  False), and :writer: is told to discard the old records of
+  files parsed from the start again. Files larger than
+  :chunk_size: bytes are split into several jobs.
+  """
+  for path in paths:
+    identifier = os.path.relpath(path, logdir)
+    kind = compressed.detect(path)
+
+    start, end = 0, None
+    if index is not None:
+      # Only parse complete lines, so that the next run can
+      # pick up where this one stopped. Compressed files can
+      # only be picked up again where a new member starts.
+      if kind is None:
+        end = last_line_end(path)
+      else:
+        end = os.path.getsize(path)
+      if resume:
+        start = index.resume_offset(identifier, path, signatures)
+      if start == 0:
+        writer.discard(identifier)
+      index.update(identifier, path, end, signatures)
+      if start >= end:
+        logger.debug("Nothing new in '{0}'".format(identifier))
+        continue
+
+    if chunk_size > 0 and kind in (None, 'gzip'):
+      split = chunk_offsets if kind is None \
+          else compressed.gzip_member_offsets
+      for chunk_start, chunk_end in split(path, chunk_size, start, end):
+        yield identifier, path, chunk_start, chunk_end
+    else:
+      yield identifier, path, start, end
 
 
 def list(args):
   """ List system information """
 
   if args.infotype == 'parsers':
-    for name, parser in available_parsers(args).iteritems():
-      print("{0:15} - {1}".format(name, parser.desc))
+    for name, desc in describe_parsers(args).iteritems():
+      print("{0:15} - {1}".format(name, desc))
     return
 
+  if args.infotype == 'contents':
+    if args.input is None:
+      logger.error("'list contents' needs a file output by 'parse'")
+      raise RuntimeError()
+    from logparser.postprocess.util import contents
+    for fname, parsers in sorted(contents(args.input).iteritems()):
+      for parser, rows in sorted(parsers.iteritems()):
+        print("{0:30} {1:20} {2:>10}".format(fname, parser, rows))
+    return
 
-def parse(args):
 
-  parsers = dict(((p, available_parsers(args).get(p)) for p in args.parsers))
+def load_parsers(opts, names):
+  """ Return the parsers called :names:, keyed by name, or
+  raise RuntimeError if any of them can't be found """
+  loaded = available_parsers(opts, names)
+  parsers = dict(((p, loaded.get(p)) for p in names))
 
   missing_parsers = [p[0] for p in parsers.iteritems() if p[1] is None]
 
@@ -96,21 +537,85 @@ def parse(args):
                 .format(missing_parsers))
     raise RuntimeError
 
-  datafiles = {}
-  processed = 0
+  return parsers
+
+
+def parse(args):
+
+  parsers = load_parsers(args, args.parsers)
 
-  for (dirpath, dirnames, files) in os.walk(args.logdir):
-    for file in files:
-      if file in args.lognames:
-        path = pathjoin(dirpath, file)
-        identifier = os.path.relpath(path, args.logdir)
-        datafiles[identifier] = parse_file(identifier, path,
-                                           parsers, highlight=args.visual)
-        processed += 1
+  if args.jobs > 1 and args.visual:
+    logger.warn("Can't show parsed lines from multiple jobs. "
+                "Parsing serially.")
+    args.jobs = 1
 
-  if len(datafiles) == 0:
+  if args.pipeline and (args.visual or args.mmap):
+    logger.warn("Can't show parsed lines or memory-map files in a "
+                "pipeline. Parsing serially.")
+    args.pipeline = False
+
+  # Stateful parsers need to see every line of a file in order,
+  # so files can only be split if none have been requested.
+  stateful = [name for name, parser in parsers.iteritems()
+              if getattr(parser, 'stateful', False)]
+  chunk_size = args.chunk_size * 1024 * 1024
+  if stateful and args.jobs > 1:
+    logger.debug("Not splitting files for stateful parsers {0}"
+                 .format(stateful))
+  if stateful or args.jobs <= 1:
+    chunk_size = 0
+
+  index = None
+  signatures = None
+  if args.incremental:
+    index = CheckpointIndex(args.o + '.idx')
+    signatures = dict((name, signature(parser))
+                      for name, parser in parsers.iteritems())
+    if not os.path.exists(args.o):
+      index.files = {}
+
+  matcher = LogMatcher(args.lognames, regex=args.regex,
+                       include_dirs=args.include_dir,
+                       exclude_dirs=args.exclude_dir)
+  paths = discover(args.logdir, matcher, args.discovery_threads)
+
+  # Don't touch the output unless there is something to parse
+  first = next(paths, None)
+  if first is None:
     logger.warn("No files found")
     raise RuntimeError
+  paths = itertools.chain([first], paths)
+
+  writer = WRITERS[args.format](args.o, parsers, resume=args.incremental)
+  jobs = plan_jobs(paths, args.logdir, writer, index, signatures,
+                   resume=not stateful, chunk_size=chunk_size)
+  stats = ParserStats() if args.stats else None
+  try:
+    if args.jobs > 1:
+      parse_files_parallel(jobs, args.parsers, args.parser_opts, args.jobs,
+                           writer, show_progress=not args.no_progress,
+                           scan=args.mmap, stats=stats)
+    elif args.pipeline:
+      from logparser.pipeline import Pipeline
+      readers = 1 if stateful else args.readers
+      Pipeline(parsers, writer, readers=readers,
+               show_progress=not args.no_progress, stats=stats).run(jobs)
+    else:
+      for identifier, path, start, end in jobs:
+        parse_file(identifier, path, parsers, highlight=args.visual,
+                   start=start, end=end,
+                   data=writer.file(identifier, args.parsers),
+                   show_progress=not args.no_progress, scan=args.mmap,
+                   stats=stats)
+        writer.done(identifier)
+  except:
+    writer.abort()
+    raise
+
+  writer.close()
+  if index is not None:
+    index.save()
 
-  with open(args.o, 'w') as fout:
-    json.dump(datafiles, fout, indent=2)
+  if stats is not None:
+    logger.info("Parser statistics:\n{0}".format(stats.table()))
+    stats.save(args.o + '.stats.json')
@@ -0,0 +1,198 @@
+""" Finding the log files to parse.
+
+Log names are matched as shell-style globs (or as regular
+expressions), and also match rotated and compressed copies such
+as NAME.1 and NAME.2.gz. Directories are listed by a pool of
+threads, since on network filesystems most of the time is spent
+waiting for each listing, and files are handed out as soon as
+they are found.
+"""
+import os
+import re
+import fnmatch
+import threading
+import Queue
+from os.path import join as pathjoin
+
+from logparser import compressed
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+  from os import scandir
+except ImportError:
+  try:
+    from scandir import scandir
+  except ImportError:
+    scandir = None
+
+# How many directories are listed at once.
+DISCOVERY_THREADS = 8
+
+
+def _listdir(path):
+  """ Yield (name, is_file, descend) for each entry in :path:.
+
+  Like os.walk, symbolic links to directories are neither
+  files nor followed.
+  """
+  if scandir is not None:
+    for entry in scandir(path):
+      if entry.is_dir():
+        yield entry.name, False, not entry.is_symlink()
+      else:
+        yield entry.name, True, False
+    return
+
+  for name in os.listdir(path):
+    full = pathjoin(path, name)
+    if os.path.isdir(full):
+      yield name, False, not os.path.islink(full)
+    else:
+      yield name, True, False
+
+
+def rotated_names(filename):
+  """ Return :filename: along with the names it would have had
+  before being rotated or compressed.
+
+  >>> rotated_names('auth.log.2.gz')
+  ['auth.log.2.gz', 'auth.log.2', 'auth.log']
+  >>> rotated_names('auth.log')
+  ['auth.log']
+  """
+  names = [filename]
+  base, ext = os.path.splitext(filename)
+  if ext in compressed.EXTENSIONS:
+    names.append(base)
+    base, ext = os.path.splitext(base)
+  if ext[1:].isdigit():
+    names.append(base)
+  return names
+
+
+class LogMatcher(object):
+  """ Decide which files and directories to parse.
+
+  :lognames: are shell-style globs, or regular expressions
+  which must match the whole name if :regex: is set. A file
+  matches if its name, or the name it had before being
+  rotated or compressed, matches any of them.
+
+  Directories matching any of the globs in :exclude_dirs: are
+  skipped entirely. If :include_dirs: are given, only files
+  somewhere below a directory matching one of them are
+  parsed. Directory globs are matched against both the name
+  of the directory and its path below the top directory.
+
+  >>> match = LogMatcher(['auth.log', 'tor-*.log'])
+  >>> [match(f) for f in ('auth.log', 'auth.log.1', 'tor-2.log.3.gz',
+  ...                     'auth.logs')]
+  [True, True, True, False]
+  >>> LogMatcher([r'tor-\d+\.log'], regex=True)('tor-12.log')
+  True
+  """
+
+  def __init__(self, lognames, regex=False, include_dirs=(),
+               exclude_dirs=()):
+    if regex:
+      patterns = [r'(?:{0})\Z'.format(name) for name in lognames]
+    else:
+      patterns = [fnmatch.translate(name) for name in lognames]
+    self.pattern = re.compile('|'.join(patterns))
+    self.include_dirs = tuple(include_dirs)
+    self.exclude_dirs = tuple(exclude_dirs)
+
+  def __call__(self, filename):
+    match = self.pattern.match
+    return any(match(name) for name in rotated_names(filename))
+
+  def current(self, filename):
+    """ Whether :filename: itself matches, and isn't a rotated
+    or compressed copy of a log
+
+    >>> match = LogMatcher(['auth*'])
+    >>> [match.current(f) for f in ('auth.log', 'auth.log.1', 'auth.log.gz')]
+    [True, False, False]
+    """
+    return len(rotated_names(filename)) == 1 and \
+        self.pattern.match(filename) is not None
+
+  def _dir_matches(self, relpath, patterns):
+    name = os.path.basename(relpath)
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p)
+               for p in patterns)
+
+  def descend(self, relpath):
+    """ Whether to look inside the directory :relpath: """
+    return not self._dir_matches(relpath, self.exclude_dirs)
+
+  def included(self, relpath):
+    """ Whether :relpath: is a directory listed in
+    :include_dirs: """
+    return self._dir_matches(relpath, self.include_dirs)
+
+
+def discover(root, matcher, threads=DISCOVERY_THREADS):
+  """ Yield the path of every file below :root: which
+  :matcher: (a LogMatcher) accepts, as soon as it is found.
+
+  Directories are listed by :threads: threads at once, so
+  files are found in no particular order.
+  """
+  found = Queue.Queue()
+  todo = Queue.Queue()
+  stop = threading.Event()
+  state = {'pending': 1}
+  lock = threading.Lock()
+  done = object()
+
+  todo.put((root, not matcher.include_dirs))
+
+  def list_dirs():
+    while True:
+      path, included = todo.get()
+      if path is None or stop.is_set():
+        return
+
+      try:
+        for name, is_file, descend in _listdir(path):
+          full = pathjoin(path, name)
+          if is_file:
+            if included and matcher(name):
+              found.put(full)
+            continue
+          if not descend:
+            continue
+
+          relpath = os.path.relpath(full, root)
+          if matcher.descend(relpath):
+            with lock:
+              state['pending'] += 1
+            todo.put((full, included or matcher.included(relpath)))
+      except OSError as e:
+        logger.debug("Can't list '{0}': {1}".format(path, e))
+      finally:
+        with lock:
+          state['pending'] -= 1
+          if state['pending'] == 0:
+            found.put(done)
+
+  workers = [threading.Thread(target=list_dirs) for _ in xrange(threads)]
+  for worker in workers:
+    worker.daemon = True
+    worker.start()
+
+  try:
+    while True:
+      path = found.get()
+      if path is done:
+        break
+      yield path
+  finally:
+    stop.set()
+    for worker in workers:
+      todo.put((None, None))
+    for worker in workers:
+      worker.join()
@@ -0,0 +1,259 @@
+import re
+import sre_parse
+from sre_constants import (LITERAL, SUBPATTERN, MAX_REPEAT, MIN_REPEAT, AT,
+                           AT_BEGINNING_STRING, ASSERT, ASSERT_NOT)
+from logparser.parsers import ConversionError, matcher
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _literal_runs(subpattern):
+  """ Find runs of literal characters which must appear in
+  any string matched by the parsed :subpattern:
+
+  Returns a tuple of the list of runs (each a list of
+  character codes) and whether the whole subpattern is a
+  single literal run.
+  """
+  runs = []
+  current = []
+  whole = True
+
+  for op, av in subpattern:
+    if op is LITERAL:
+      current.append(av)
+      continue
+
+    if op is SUBPATTERN:
+      inner, inner_whole = _literal_runs(av[-1])
+      if inner_whole:
+        current.extend(inner[0] if inner else [])
+        continue
+      runs.extend(inner)
+
+    elif op in (MAX_REPEAT, MIN_REPEAT) and av[0] > 0:
+      runs.extend(_literal_runs(av[2])[0])
+
+    whole = False
+    if current:
+      runs.append(current)
+    current = []
+
+  if current:
+    runs.append(current)
+
+  return runs, whole
+
+
+def required_literal(pattern):
+  """ Return the longest literal string that has to appear
+  in any line matched by the regular expression :pattern:,
+  or None if there isn't one that can be used safely.
+
+  >>> required_literal(r'(\d+) sshd.*: Failed password for (\w+)')
+  ': Failed password for '
+  >>> required_literal(r'(?i)failed') is None
+  True
+  >>> required_literal(r'(\d+|\w+)') is None
+  True
+  """
+  try:
+    if re.compile(pattern).flags & re.IGNORECASE:
+      return None
+    runs, _ = _literal_runs(sre_parse.parse(pattern))
+  except re.error:
+    return None
+
+  # Lines are byte strings, so only plain ASCII is safe to
+  # compare regardless of the pattern's type.
+  runs = [run for run in runs if all(c < 128 for c in run)]
+  if not runs:
+    return None
+
+  return ''.join(chr(c) for c in max(runs, key=len))
+
+
+def _walk(subpattern):
+  """ Yield every (op, av) in the parsed :subpattern:,
+  including those nested in groups, repeats, branches and
+  assertions """
+  for op, av in subpattern:
+    yield op, av
+    for item in (av if isinstance(av, (tuple, list)) else (av,)):
+      for part in (item if isinstance(item, list) else (item,)):
+        if isinstance(part, sre_parse.SubPattern):
+          for nested in _walk(part):
+            yield nested
+
+
+def matches_in_place(pattern):
+  """ Return whether matching the regular expression :pattern:
+  against a line in place, within a larger buffer (using the
+  `pos' and `endpos' arguments of re's match), gives the same
+  result as matching the line on its own.
+
+  `\A' and lookbehind assertions see what comes before `pos',
+  so patterns which use them have to be given each line on
+  its own.
+
+  >>> matches_in_place(r'(\w+) x$')
+  True
+  >>> matches_in_place(r'\A(\w+) x$')
+  False
+  >>> matches_in_place(r'(a|(?<!: )b)')
+  False
+  """
+  try:
+    parsed = sre_parse.parse(pattern)
+  except re.error:
+    return False
+
+  for op, av in _walk(parsed):
+    if op is AT and av is AT_BEGINNING_STRING:
+      return False
+    if op in (ASSERT, ASSERT_NOT) and av[0] < 0:
+      return False
+  return True
+
+
+class Dispatcher(object):
+  """ Apply a set of parsers to lines.
+
+  Parsers with a `batch' attribute are handed whole blocks of
+  lines at once (see `block'). The others are applied one line
+  at a time.
+
+  Those may declare a `prefilter' attribute holding a string
+  which must appear in any line they can match. All prefilter
+  strings are combined into a single regular expression, so a
+  line which can't match any of those parsers is rejected with
+  one search. Lines which do pass are only handed to the
+  parsers whose prefilter they contain. Parsers without a
+  prefilter see every line.
+
+  A parser which raises ConversionError (because what it
+  matched couldn't be converted) is taken not to have matched the
+  line, and a warning is logged the first time. A block which
+  a batch parser fails on is parsed again one line at a time.
+
+  If :stats: (a logparser.stats.ParserStats) is given, every
+  parser is counted and timed.
+  """
+
+  def __init__(self, parsers, stats=None):
+    """ :parsers: is a dictionary of parser callables
+    keyed by name """
+    self.batched = []
+    self.unfiltered = []
+    self.filtered = []
+    self.matchers = {}
+    self.failed = set()
+
+    for name, parser in parsers.iteritems():
+      batch = getattr(parser, 'batch', None)
+      literal = getattr(parser, 'prefilter', None)
+      match = matcher(parser)
+      if stats is not None:
+        match = stats.match(name, match)
+        if batch is not None:
+          batch = stats.batch(name, batch)
+      self.matchers[name] = match
+
+      if batch is not None:
+        self.batched.append((name, batch))
+      elif literal:
+        self.filtered.append((literal, name, match))
+      else:
+        self.unfiltered.append((name, match))
+
+    if self.filtered:
+      literals = set(literal for literal, _, _ in self.filtered)
+      self.candidates = re.compile('|'.join(re.escape(literal)
+                                            for literal in literals)).search
+      logger.debug("Prefiltering lines for {0}"
+                   .format([name for _, name, _ in self.filtered]))
+
+  def block(self, lines, data):
+    """ Run every parser over the list :lines:, and append
+    what they parsed to the lists in :data:, which is keyed by
+    parser name. Each parser's records are appended in line
+    order.
+
+    Returns the set of indices of the lines any parser
+    matched.
+    """
+    matched = set()
+
+    for parser_name, batch in self.batched:
+      try:
+        found = batch(lines)
+      except ConversionError:
+        found = self.each_line(parser_name, lines)
+
+      records = data[parser_name]
+      for index, record in found:
+        records.append(record)
+        matched.add(index)
+
+    if self.unfiltered or self.filtered:
+      parse_line = self._line
+      for index, line in enumerate(lines):
+        if parse_line(line, data):
+          matched.add(index)
+
+    return matched
+
+  def _failed(self, parser_name, error):
+    if parser_name not in self.failed:
+      self.failed.add(parser_name)
+      logger.warn("'{0}' skipped a line it couldn't convert: {1}"
+                  .format(parser_name, error))
+    else:
+      logger.debug("'{0}': {1}".format(parser_name, error))
+
+  def each_line(self, parser_name, lines):
+    """ Return (index, data) for each of :lines: the parser
+    :parser_name: matches, skipping those it fails on """
+    match = self.matchers[parser_name]
+    found = []
+    for index, line in enumerate(lines):
+      try:
+        parsed = match(line)
+      except ConversionError as e:
+        self._failed(parser_name, e)
+        continue
+      if parsed is not None:
+        found.append((index, parsed.data))
+    return found
+
+  def _line(self, line, data):
+    """ Apply the parsers without a `batch' attribute to
+    :line: """
+    line_parsed = False
+
+    for parser_name, match in self.unfiltered:
+      try:
+        parsed = match(line)
+      except ConversionError as e:
+        self._failed(parser_name, e)
+        continue
+      if parsed is not None:
+        data[parser_name].append(parsed.data)
+        line_parsed = True
+
+    if self.filtered and self.candidates(line) is not None:
+      for literal, parser_name, match in self.filtered:
+        if literal not in line:
+          continue
+
+        try:
+          parsed = match(line)
+        except ConversionError as e:
+          self._failed(parser_name, e)
+          continue
+        if parsed is not None:
+          data[parser_name].append(parsed.data)
+          line_parsed = True
+
+    return line_parsed
@@ -0,0 +1,413 @@
+""" Following logs as they are written.
+
+`follow' keeps running, and parses lines as soon as they are
+appended to the logs it watches. Records are written as JSON
+Lines (see logparser.output), either to a file or to every
+client connected to a local socket.
+
+Files are watched with inotify if pyinotify is installed, and
+are polled otherwise. A log which is rotated (renamed and
+replaced by a new file) is read to its end before the new file
+is followed, and a log which is truncated in place is read
+again from the start. Only the logs themselves are followed,
+not their rotated copies. Timestamps without a year are given
+the year it is when they are read (see
+logparser.timestamps.year_of), which moves on at New Year.
+
+How long each line took from being read to being emitted (parsed,
+serialized and flushed out) is measured, and reported every so
+often. When a line was written to its log isn't known: file
+modification times only say when the last line was, and often only
+to the second.
+"""
+import os
+import sys
+import stat
+import time
+import errno
+import signal
+import socket
+import cStringIO
+import collections
+
+from logparser.core import load_parsers
+from logparser.checkpoint import last_line_end
+from logparser.discovery import LogMatcher, discover, DISCOVERY_THREADS
+from logparser.dispatch import Dispatcher
+from logparser.output import RecordStream
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Bytes read from a log at a time.
+READ_SIZE = 1024 * 1024
+
+# How many of the most recent latencies percentiles are taken
+# over.
+LATENCY_SAMPLES = 10000
+
+# How long a socket client may take to accept a batch of
+# records before it is disconnected.
+CLIENT_TIMEOUT = 1.0
+
+
+class Tail(object):
+  """ Read the lines appended to :path:, starting at byte
+  :start:, across rotation and truncation. """
+
+  def __init__(self, path, start=0):
+    self.path = path
+    self.fd = None
+    self._open(start)
+
+  def _open(self, start):
+    self.fd = os.open(self.path, os.O_RDONLY)
+    self.inode = os.fstat(self.fd).st_ino
+    os.lseek(self.fd, start, os.SEEK_SET)
+    self.pos = start
+    self.rest = ''
+
+  def _drain(self, batches):
+    """ Read everything up to the end of the open file, and
+    add its complete lines to :batches: """
+    chunks = []
+    while True:
+      chunk = os.read(self.fd, READ_SIZE)
+      if not chunk:
+        break
+      chunks.append(chunk)
+    if not chunks:
+      return
+
+    read_at = time.time()
+    text = self.rest + ''.join(chunks)
+    self.pos += len(text) - len(self.rest)
+    cut = text.rfind('\n') + 1
+    self.rest = text[cut:]
+    if cut:
+      batches.append((cStringIO.StringIO(text[:cut]).readlines(), read_at))
+
+  def _flush(self, batches):
+    """ Hand over a last line which never got its newline """
+    if self.rest:
+      batches.append(([self.rest], time.time()))
+      self.rest = ''
+
+  def read(self):
+    """ Return a list of (lines, read_at) batches of the lines
+    which have been completed since the last call, where
+    :read_at: is when they were read """
+    batches = []
+    self._drain(batches)
+    try:
+      current = os.stat(self.path)
+    except OSError:
+      # Rotated, and not replaced yet
+      return batches
+
+    if current.st_ino != self.inode:
+      logger.info("'{0}' was rotated".format(self.path))
+      self._flush(batches)
+      os.close(self.fd)
+      self._open(0)
+      self._drain(batches)
+    elif current.st_size < self.pos:
+      logger.info("'{0}' was truncated".format(self.path))
+      self._flush(batches)
+      os.lseek(self.fd, 0, os.SEEK_SET)
+      self.pos = 0
+      self._drain(batches)
+
+    return batches
+
+  def close(self):
+    """ Return the last of the lines and stop reading """
+    batches = []
+    self._drain(batches)
+    self._flush(batches)
+    os.close(self.fd)
+    return batches
+
+
+class LatencyStats(object):
+  """ Summarise how long lines took from being read to being
+  emitted, in seconds. Percentiles are taken over the last
+  LATENCY_SAMPLES lines.
+
+  >>> stats = LatencyStats()
+  >>> stats.add(0.002, 3)
+  >>> stats.add(0.010)
+  >>> print(stats)
+  4 lines, read to emit mean 4.0ms p50 2.0ms p99 10.0ms max 10.0ms
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.samples = collections.deque(maxlen=LATENCY_SAMPLES)
+
+  def add(self, latency, lines=1):
+    """ Record that :lines: lines took :latency: seconds """
+    latency = max(latency, 0.0)
+    self.count += lines
+    self.total += latency * lines
+    self.max = max(self.max, latency)
+    self.samples.extend([latency] * min(lines, LATENCY_SAMPLES))
+
+  def percentile(self, p):
+    ordered = sorted(self.samples)
+    if not ordered:
+      return 0.0
+    return ordered[min(int(len(ordered) * p / 100.0), len(ordered) - 1)]
+
+  def __str__(self):
+    if not self.count:
+      return "0 lines"
+    return ("{0} lines, read to emit mean {1:.1f}ms p50 {2:.1f}ms p99 {3:.1f}ms "
+            "max {4:.1f}ms".format(self.count, self.total / self.count * 1e3,
+                                   self.percentile(50) * 1e3,
+                                   self.percentile(99) * 1e3, self.max * 1e3))
+
+
+class SocketSink(object):
+  """ A file-like object which sends what is written to it to
+  every client connected to the Unix socket at :path:, each
+  time it is flushed. Clients which connect only get what is
+  written from then on. """
+
+  def __init__(self, path):
+    self.path = path
+    self.buffer = []
+    self.clients = []
+
+    try:
+      if stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)
+    except OSError:
+      pass
+
+    self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.server.bind(path)
+    self.server.listen(5)
+    self.server.setblocking(False)
+
+  def _accept(self):
+    while True:
+      try:
+        client, _ = self.server.accept()
+      except socket.error as e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return
+        raise
+      client.settimeout(CLIENT_TIMEOUT)
+      self.clients.append(client)
+      logger.debug("Client connected to '{0}'".format(self.path))
+
+  def write(self, text):
+    self.buffer.append(text)
+
+  def flush(self):
+    self._accept()
+    if not self.buffer:
+      return
+
+    text = ''.join(self.buffer)
+    self.buffer = []
+    for client in self.clients[:]:
+      try:
+        client.sendall(text)
+      except socket.error as e:
+        logger.debug("Dropping client of '{0}': {1}".format(self.path, e))
+        client.close()
+        self.clients.remove(client)
+
+  def close(self):
+    self.flush()
+    for client in self.clients:
+      client.close()
+    self.server.close()
+    os.remove(self.path)
+
+
+class PollingWatcher(object):
+  """ Wait for logs to change by checking every :interval:
+  seconds """
+
+  def __init__(self, root, interval):
+    self.interval = interval
+
+  def wait(self, timeout):
+    """ Wait until the logs may have changed, for at most
+    :timeout: seconds. Returns whether files may have been
+    created. """
+    time.sleep(max(min(timeout, self.interval), 0))
+    return False
+
+
+class InotifyWatcher(object):
+  """ Wait for logs to change by watching :root: with
+  inotify """
+
+  def __init__(self, root, pyinotify):
+    self.created = False
+    self.creation = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO
+    mask = self.creation | pyinotify.IN_MODIFY | pyinotify.IN_MOVED_FROM | \
+        pyinotify.IN_DELETE
+
+    self.manager = pyinotify.WatchManager()
+    self.notifier = pyinotify.Notifier(self.manager, self._event)
+    self.manager.add_watch(root, mask, rec=True, auto_add=True)
+
+  def _event(self, event):
+    if event.mask & self.creation:
+      self.created = True
+
+  def wait(self, timeout):
+    if self.notifier.check_events(max(timeout, 0) * 1000):
+      self.notifier.read_events()
+      self.notifier.process_events()
+
+    created, self.created = self.created, False
+    return created
+
+
+def watcher(root, interval, poll=False):
+  """ Return an InotifyWatcher for :root: if possible, or
+  else a PollingWatcher checking every :interval: seconds """
+  if not poll:
+    try:
+      import pyinotify
+      return InotifyWatcher(root, pyinotify)
+    except ImportError as e:
+      logger.debug("Polling for changes. ImportError: {0}".format(e))
+    except Exception as e:
+      logger.warn("Can't watch '{0}' with inotify. Polling for changes."
+                  .format(root))
+      logger.debug("Inotify Error: {0}".format(e))
+
+  return PollingWatcher(root, interval)
+
+
+class Follower(object):
+  """ Parse lines appended to the logs below :logdir: which
+  :matcher: (a LogMatcher) accepts, and write the records to
+  :sink: as JSON Lines.
+
+  Logs which exist to begin with are followed from their end,
+  unless :from_start: is set. Logs which appear later are
+  read from the start.
+  """
+
+  def __init__(self, logdir, matcher, parsers, sink, from_start=False,
+               threads=DISCOVERY_THREADS):
+    self.logdir = logdir
+    self.matcher = matcher
+    self.parsers = sorted(parsers)
+    self.sink = sink
+    self.threads = threads
+    self.dispatch = Dispatcher(parsers)
+    self.latency = LatencyStats()
+    self.tails = {}
+    self.streams = {}
+    self.rescan(from_start=from_start, initial=True)
+
+  def rescan(self, from_start=True, initial=False):
+    """ Start following new logs, and stop following those
+    which have gone away """
+    found = set(path for path in discover(self.logdir, self.matcher,
+                                          self.threads)
+                if self.matcher.current(os.path.basename(path)))
+
+    for path in found.difference(self.tails):
+      try:
+        self.tails[path] = Tail(path, 0 if from_start else last_line_end(path))
+      except (IOError, OSError) as e:
+        logger.debug("Can't follow '{0}': {1}".format(path, e))
+        continue
+      if not initial:
+        logger.info("Following '{0}'".format(path))
+
+    for path in set(self.tails).difference(found):
+      if not os.path.exists(path):
+        self._emit(path, self.tails.pop(path).close())
+        self.streams.pop(path, None)
+        logger.info("Stopped following '{0}'".format(path))
+
+  def _emit(self, path, batches):
+    streams = self.streams.get(path)
+    if streams is None:
+      identifier = os.path.relpath(path, self.logdir)
+      streams = self.streams[path] = dict(
+          (p, RecordStream(self.sink, identifier, p)) for p in self.parsers)
+
+    for lines, _ in batches:
+      self.dispatch.block(lines, streams)
+
+  def poll(self):
+    """ Parse whatever has been written to each log since the
+    last call, and flush the records out """
+    read = []
+    for path, tail in self.tails.iteritems():
+      batches = tail.read()
+      if batches:
+        self._emit(path, batches)
+        read.extend(batches)
+    self.sink.flush()
+
+    now = time.time()
+    for lines, read_at in read:
+      self.latency.add(now - read_at, len(lines))
+
+  def close(self):
+    for path, tail in self.tails.iteritems():
+      self._emit(path, tail.close())
+    self.tails = {}
+    self.sink.flush()
+
+
+def _terminate(signum, frame):
+  sys.exit(0)
+
+
+def follow(args):
+  parsers = load_parsers(args, args.parsers)
+  matcher = LogMatcher(args.lognames, regex=args.regex,
+                       include_dirs=args.include_dir,
+                       exclude_dirs=args.exclude_dir)
+
+  sink = SocketSink(args.socket) if args.socket else open(args.o, 'a')
+  follower = None
+  try:
+    follower = Follower(args.logdir, matcher, parsers, sink,
+                        from_start=args.from_start,
+                        threads=args.discovery_threads)
+    if not follower.tails:
+      logger.warn("No files found yet. Waiting for some to appear.")
+
+    watch = watcher(args.logdir, args.poll_interval, poll=args.poll)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    now = time.time()
+    next_rescan = now + args.rescan
+    next_stats = now + args.stats_interval
+    created = False
+    while True:
+      follower.poll()
+
+      now = time.time()
+      if created or now >= next_rescan:
+        follower.rescan()
+        next_rescan = now + args.rescan
+      if now >= next_stats:
+        logger.info(str(follower.latency))
+        next_stats = now + args.stats_interval
+
+      created = watch.wait(min(next_rescan, next_stats) - now)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if follower is not None:
+      follower.close()
+      logger.info(str(follower.latency))
+    sink.close()
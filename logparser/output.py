@@ -0,0 +1,433 @@
+""" Writers for the data produced by `parse'.
+
+A writer hands out one dictionary per parsed file, keyed by
+parser name. Parsed records are appended to the values of
+that dictionary, so a writer decides whether records are kept
+in memory until the end or written out as they arrive.
+
+Writers also get told when a file is `done', after which no
+more records will be added for it. When resuming earlier
+output, a writer may be told to `discard' what it already has
+for a file which is being parsed again from the start.
+"""
+import os
+import os.path
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class JSONWriter(object):
+  """ Keep every record in memory and write them as one
+  JSON document, keyed by file and then parser. """
+
+  def __init__(self, path, parsers, resume=False):
+    """ If :resume: is set, keep the records already in
+    :path:. """
+    self.path = path
+    self.datafiles = {}
+
+    if resume and os.path.exists(path):
+      with open(path) as fin:
+        self.datafiles = json.load(fin)
+
+  def discard(self, identifier):
+    """ Forget the records kept from an earlier run for
+    :identifier: """
+    self.datafiles.pop(identifier, None)
+
+  def file(self, identifier, parsers):
+    """ Return the dictionary that records parsed by
+    :parsers: from :identifier: should be appended to """
+    data = self.datafiles.setdefault(identifier, {})
+    for p in parsers:
+      data.setdefault(p, [])
+    return data
+
+  def done(self, identifier):
+    pass
+
+  def close(self):
+    with open(self.path, 'w') as fout:
+      json.dump(self.datafiles, fout, indent=2, sort_keys=True)
+
+  def abort(self):
+    """ Parsing failed, so don't write anything """
+    pass
+
+
+class RecordStream(object):
+  """ A write-only list of records, each of which is written
+  to :fout: as a JSON line tagged with its file and parser """
+
+  def __init__(self, fout, identifier, parser):
+    self.write = fout.write
+    self.prefix = '{{"file": {0}, "parser": {1}, "data": '.format(
+        json.dumps(identifier), json.dumps(parser))
+    self.count = 0
+
+  def append(self, record):
+    self.write(self.prefix)
+    self.write(json.dumps(record, sort_keys=True))
+    self.write('}\n')
+    self.count += 1
+
+  def extend(self, records):
+    for record in records:
+      self.append(record)
+
+  def __len__(self):
+    return self.count
+
+
+class JSONLinesWriter(object):
+  """ Write each record as soon as it is parsed, one JSON
+  object per line:
+
+      {"file": "a/log", "parser": "pingbound", "data": {...}}
+  """
+
+  def __init__(self, path, parsers, resume=False):
+    """ If :resume: is set, new records are appended to those
+    already in :path:. """
+    self.path = path
+    self.streams = {}
+    self.discarded = set()
+    # How much of the output was written by an earlier run
+    self.resumed = 0
+
+    if resume and os.path.exists(path):
+      self.resumed = os.path.getsize(path)
+      self.fout = open(path, 'a')
+    else:
+      self.fout = open(path, 'w')
+
+  def discard(self, identifier):
+    """ Drop the records from an earlier run for :identifier:
+    once the output is closed """
+    self.discarded.add(identifier)
+
+  def _drop(self, identifiers, end):
+    """ Rewrite the output without the records from
+    :identifiers: in its first :end: bytes """
+    tmp = self.path + '.tmp'
+    with open(self.path) as fin:
+      with open(tmp, 'w') as fout:
+        pos = 0
+        for line in fin:
+          old = pos < end
+          pos += len(line)
+          if old and line.strip() and json.loads(line)['file'] in identifiers:
+            continue
+          fout.write(line)
+    os.rename(tmp, self.path)
+
+  def file(self, identifier, parsers):
+    if identifier not in self.streams:
+      self.streams[identifier] = dict(
+          (p, RecordStream(self.fout, identifier, p)) for p in parsers)
+    return self.streams[identifier]
+
+  def done(self, identifier):
+    pass
+
+  def close(self):
+    self.fout.close()
+    if self.discarded and self.resumed:
+      self._drop(self.discarded, self.resumed)
+
+  def abort(self):
+    """ Leave the output as the last complete run left it """
+    self.fout.close()
+    if self.resumed:
+      with open(self.path, 'r+') as fout:
+        fout.truncate(self.resumed)
+
+
+# NumPy dtypes for the field types known to SimpleRegex. Strings
+# are stored separately, as codes into a table of distinct values.
+COLUMN_DTYPES = {
+    'int': 'int64',
+    'time': 'int64',
+    'float': 'float64',
+    'boolean': 'bool'
+}
+
+
+def infer_field_types(records):
+  """ Guess (name, type) pairs for a parser which doesn't
+  declare `field_types', from the first of its :records: """
+  if not records:
+    return ()
+
+  types = []
+  for name, val in sorted(records[0].iteritems()):
+    if isinstance(val, bool):
+      types.append((name, 'boolean'))
+    elif isinstance(val, (int, long)):
+      types.append((name, 'int'))
+    elif isinstance(val, float):
+      types.append((name, 'float'))
+    elif isinstance(val, basestring):
+      types.append((name, 'str'))
+  return tuple(types)
+
+
+class ColumnarWriter(object):
+  """ Write the records of each file and parser as typed
+  column arrays, in a directory of NumPy .npy files which can
+  be memory-mapped when read back.
+
+  Column types come from the `field_types' of each parser.
+  String columns are dictionary-encoded: an array of integer
+  codes plus an array of the distinct values. Columns which
+  can't be stored in an array (such as lists) are skipped.
+
+  The directory contains a `manifest.json' describing every
+  column:
+
+      {"files": {"auth.log": {"failed_attempts": {
+          "rows": 2,
+          "columns": [{"name": "username", "type": "str",
+                       "data": "0.0.2.npy",
+                       "categories": "0.0.2.cat.npy"}, ...]
+      }}}}
+  """
+
+  MANIFEST = 'manifest.json'
+
+  def __init__(self, path, parsers, resume=False):
+    if resume:
+      logger.error("Columnar output can't be parsed incrementally")
+      raise RuntimeError()
+
+    try:
+      import numpy
+    except ImportError as e:
+      logger.error("Columnar output requires numpy")
+      logger.debug("ImportError: {0}".format(e))
+      raise RuntimeError()
+
+    self.np = numpy
+    self.path = path
+    self.field_types = dict((name, getattr(parser, 'field_types', None))
+                            for name, parser in parsers.iteritems())
+    self.pending = {}
+    self.manifest = {'format': 'columnar', 'version': 1, 'files': {}}
+
+    if not os.path.isdir(path):
+      os.makedirs(path)
+
+  def file(self, identifier, parsers):
+    if identifier not in self.pending:
+      self.pending[identifier] = dict((p, []) for p in parsers)
+    return self.pending[identifier]
+
+  def done(self, identifier):
+    data = self.pending.pop(identifier)
+    fileno = len(self.manifest['files'])
+
+    columns = {}
+    for parserno, (parser, records) in enumerate(sorted(data.iteritems())):
+      prefix = '{0}.{1}'.format(fileno, parserno)
+      columns[parser] = self._write_columns(prefix, parser, records)
+
+    self.manifest['files'][identifier] = columns
+
+  def _save(self, name, array):
+    self.np.save(os.path.join(self.path, name), array)
+    return name
+
+  def _write_columns(self, prefix, parser, records):
+    np = self.np
+    fields = self.field_types.get(parser) or infer_field_types(records)
+
+    columns = []
+    for colno, (name, ftype) in enumerate(fields):
+      values = [record.get(name) for record in records]
+      column = {'name': name, 'type': ftype}
+
+      if ftype in COLUMN_DTYPES:
+        try:
+          array = np.array(values, dtype=COLUMN_DTYPES[ftype])
+        except (TypeError, ValueError):
+          logger.warn("Storing '{0}' from '{1}' as strings. Not all "
+                      "values are {2}".format(name, parser, ftype))
+          values = [str(val) for val in values]
+          column['type'] = ftype = 'str'
+
+      if ftype == 'str':
+        distinct = {}
+        codes = np.array([distinct.setdefault(val, len(distinct))
+                          for val in values], dtype='int32')
+        categories = [val if isinstance(val, basestring) else str(val)
+                      for val in sorted(distinct, key=distinct.get)]
+        column['categories'] = self._save(
+            '{0}.{1}.cat.npy'.format(prefix, colno),
+            np.array(categories) if categories else np.array([], 'S1'))
+        array = codes
+      elif ftype not in COLUMN_DTYPES:
+        logger.debug("Skipping '{0}' from '{1}'. Can't store '{2}' "
+                     "columns".format(name, parser, ftype))
+        continue
+
+      column['data'] = self._save('{0}.{1}.npy'.format(prefix, colno), array)
+      columns.append(column)
+
+    return {'rows': len(records), 'columns': columns}
+
+  def discard(self, identifier):
+    pass
+
+  def close(self):
+    for identifier in sorted(self.pending):
+      self.done(identifier)
+
+    with open(os.path.join(self.path, self.MANIFEST), 'w') as fout:
+      json.dump(self.manifest, fout, indent=2, sort_keys=True)
+
+  def abort(self):
+    pass
+
+
+# The last line of indexed output: this, then the offset of the
+# index as 20 digits.
+INDEX_MAGIC = 'logparser-index '
+TRAILER_SIZE = len(INDEX_MAGIC) + 21
+
+
+def read_index(fin):
+  """ Return the index at the end of the indexed output open as
+  :fin:, or None if it isn't indexed output. :fin: is left at
+  its start. """
+  fin.seek(0, os.SEEK_END)
+  index = None
+  if fin.tell() >= TRAILER_SIZE:
+    fin.seek(-TRAILER_SIZE, os.SEEK_END)
+    trailer = fin.read()
+    if trailer.startswith(INDEX_MAGIC) and trailer.endswith('\n'):
+      fin.seek(int(trailer[len(INDEX_MAGIC):]))
+      index = json.loads(fin.readline())
+  fin.seek(0)
+  return index
+
+
+class IndexedWriter(object):
+  """ Write the records of each file and parser as one section
+  of JSON lines, followed by an index of the sections, so that
+  readers can seek straight to the ones they want:
+
+      {"username": "root", ...}        <- auth.log, failed_attempts
+      ...
+      {"format": "indexed", "version": 1, "files": {"auth.log": {
+          "failed_attempts": {"offset": 0, "length": 2210, "rows": 20},
+          ...}}}
+      logparser-index 00000000000000004242
+
+  The last line holds the offset of the index. Records are kept
+  in memory until their file is done. The output is written
+  to a temporary file which replaces :path: once it is
+  complete.
+  """
+
+  def __init__(self, path, parsers, resume=False):
+    """ If :resume: is set, keep the records already in
+    :path:. """
+    self.path = path
+    self.tmp = path + '.tmp'
+    self.pending = {}
+    self.files = {}
+    self.discarded = set()
+    self.old = None
+    self.old_files = {}
+
+    if resume and os.path.exists(path):
+      self.old = open(path, 'rb')
+      index = read_index(self.old)
+      if index is None:
+        self.old.close()
+        logger.error("'{0}' isn't indexed output, so it can't be "
+                     "resumed as such".format(path))
+        raise RuntimeError()
+      self.old_files = index['files']
+
+    self.fout = open(self.tmp, 'wb')
+
+  def discard(self, identifier):
+    self.discarded.add(identifier)
+
+  def file(self, identifier, parsers):
+    if identifier not in self.pending:
+      self.pending[identifier] = dict((p, []) for p in parsers)
+    return self.pending[identifier]
+
+  def _copy(self, section):
+    """ Copy :section: of the earlier output """
+    self.old.seek(section['offset'])
+    left = section['length']
+    while left > 0:
+      chunk = self.old.read(min(left, 1 << 20))
+      if not chunk:
+        logger.error("'{0}' is shorter than its index says".format(self.path))
+        raise RuntimeError()
+      self.fout.write(chunk)
+      left -= len(chunk)
+
+  def _write_file(self, identifier, data):
+    """ Write a section for each parser of :identifier:, made
+    of what the earlier output held for it and then :data: """
+    old = {}
+    if identifier not in self.discarded:
+      old = self.old_files.get(identifier, {})
+
+    sections = {}
+    for parser in sorted(set(data) | set(old)):
+      offset = self.fout.tell()
+      rows = 0
+      if parser in old:
+        self._copy(old[parser])
+        rows += old[parser]['rows']
+      for record in data.get(parser, ()):
+        self.fout.write(json.dumps(record, sort_keys=True))
+        self.fout.write('\n')
+        rows += 1
+      sections[parser] = {'offset': offset,
+                          'length': self.fout.tell() - offset,
+                          'rows': rows}
+    self.files[identifier] = sections
+
+  def done(self, identifier):
+    self._write_file(identifier, self.pending.pop(identifier))
+
+  def close(self):
+    for identifier in sorted(self.pending):
+      self.done(identifier)
+    # Files this run had nothing new for
+    for identifier in sorted(self.old_files):
+      if identifier not in self.files and identifier not in self.discarded:
+        self._write_file(identifier, {})
+
+    offset = self.fout.tell()
+    json.dump({'format': 'indexed', 'version': 1, 'files': self.files},
+              self.fout, sort_keys=True)
+    self.fout.write('\n{0}{1:020d}\n'.format(INDEX_MAGIC, offset))
+    self.fout.close()
+    if self.old is not None:
+      self.old.close()
+    os.rename(self.tmp, self.path)
+
+  def abort(self):
+    """ Leave any earlier output as it was """
+    self.fout.close()
+    if self.old is not None:
+      self.old.close()
+    os.remove(self.tmp)
+
+
+WRITERS = {
+    'json': JSONWriter,
+    'jsonl': JSONLinesWriter,
+    'columnar': ColumnarWriter,
+    'indexed': IndexedWriter
+}
@@ -1,9 +1,23 @@
+import os
 import pkgutil
 import functools
+import hashlib
+import threading
+import collections
+from logparser.registry import Registry, stamp
+
 import logging
 logger = logging.getLogger(__name__)
 
-__all__ = ['Parser', 'available_parsers']
+__all__ = ['ConversionError', 'Parser', 'available_parsers',
+           'describe_parsers', 'matcher', 'signature']
+
+
+class ConversionError(TypeError):
+  """ Raised by a parser which matched a line but couldn't
+  convert what it matched. The line is skipped with a warning
+  (see logparser.dispatch.Dispatcher), where any other error
+  stops the parse. """
 
 
 class Parser(object):
@@ -44,15 +58,156 @@ class Parser(object):
     return str(self.data)
 
 
-def memoize(fn):
-  @functools.wraps(fn)
-  def wrapper(*args, **kwargs):
-    if not hasattr(fn, 'result'):
-      fn.result = fn(*args, **kwargs)
+def _freeze(value):
+  """ Turn :value: into something hashable, for use in a key
+
+  >>> _freeze({'b': ['1', '2'], 'a': []})
+  (('a', ()), ('b', ('1', '2')))
+  """
+  if isinstance(value, dict):
+    return tuple(sorted((k, _freeze(v)) for k, v in value.iteritems()))
+  if isinstance(value, (list, tuple, set, frozenset)):
+    return tuple(_freeze(v) for v in value)
+  return value
+
+
+class ParserCache(object):
+  """ Remember the parsers loaded by :fn: for each set of
+  options it was called with, keeping the :size: most
+  recently used.
+
+  The key is made from everything which changes what gets
+  loaded: the parser options, the names asked for and the
+  working directory (which relative paths in the options are
+  resolved against). Parsers loaded without asking for names
+  are used for any names, since they include them all.
+
+  Loading happens while holding a lock, so threads asking for
+  the same parsers at once share a single copy. Parsers with a
+  true `stateful' attribute are never shared: every call after
+  the first loads them again. Call `invalidate' after changing
+  parser definitions on disk.
+
+  >>> import argparse
+  >>> class Counter(object):
+  ...   stateful = True
+  >>> loads = []
+  >>> def load(opts, names=None):
+  ...   loads.append(names)
+  ...   return {'plain': len, 'counter': Counter()}
+  >>> cache = ParserCache(load, size=2)
+  >>> first, second = cache(None), cache(None, ['plain'])
+  >>> first['plain'] is second['plain'], first['counter'] is second['counter']
+  (True, False)
+  >>> other = argparse.Namespace(parser_opts={'n': '1'})
+  >>> for names in (['plain'], ['counter'], None):
+  ...   _ = cache(other if names else None, names)
+  >>> loads
+  [None, ['counter'], ['plain'], ['counter'], None]
+  >>> cache.invalidate(other)
+  >>> [key[2] for key in cache.entries]
+  [None]
+  """
+
+  def __init__(self, fn, size=8):
+    self.fn = fn
+    self.size = size
+    self.entries = collections.OrderedDict()
+    self.lock = threading.RLock()
+    functools.update_wrapper(self, fn)
+
+  def key(self, opts, names=None):
+    parser_opts = getattr(opts, 'parser_opts', None) or {}
+    return (_freeze(parser_opts), os.getcwd(),
+            None if names is None else tuple(sorted(set(names))))
+
+  def __call__(self, opts, names=None):
+    key = self.key(opts, names)
+    with self.lock:
+      for k in (key, key[:2] + (None,)):
+        if k in self.entries:
+          parsers = self.entries.pop(k)
+          self.entries[k] = parsers
+          return self._unshared(opts, parsers)
+
+      parsers = self.fn(opts, names)
+      self.entries[key] = parsers
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+      return dict(parsers)
+
+  def _unshared(self, opts, parsers):
+    """ Return a copy of the cached :parsers:, with the stateful
+    ones loaded again """
+    parsers = dict(parsers)
+    stateful = sorted(name for name, parser in parsers.iteritems()
+                      if getattr(parser, 'stateful', False))
+    if stateful:
+      fresh = self.fn(opts, stateful)
+      parsers.update((name, fresh[name]) for name in stateful
+                     if name in fresh)
+    return parsers
+
+  def invalidate(self, opts=None):
+    """ Forget the parsers loaded with :opts:, or all of them """
+    with self.lock:
+      if opts is None:
+        self.entries.clear()
+        return
+      prefix = self.key(opts)[:2]
+      for k in [k for k in self.entries if k[:2] == prefix]:
+        del self.entries[k]
+
+
+def matcher(parser):
+  """ Return a callable which applies :parser: to a line and
+  returns None if the line doesn't match.
+
+  Parsers which provide a `match' attribute already behave
+  this way, so it is used directly. Other parsers are wrapped
+  so that the ValueError they raise is turned into None.
+
+  >>> def odd(line):
+  ...   if len(line) % 2 == 0:
+  ...     raise ValueError
+  ...   return line
+  >>> [matcher(odd)(line) for line in ('a', 'ab')]
+  ['a', None]
+  """
+  match = getattr(parser, 'match', None)
+  if match is not None:
+    return match
+
+  def match(line):
+    try:
+      return parser(line)
+    except ValueError:
+      return None
+
+  return match
+
+
+def signature(parser):
+  """ Return a string which changes whenever the definition
+  of :parser: does.
 
-    return fn.result
+  Parsers can provide this as a `signature' attribute.
+  Otherwise it is a hash of the source file the parser (or
+  its class) is defined in.
+  """
+  sig = getattr(parser, 'signature', None)
+  if sig is not None:
+    return sig
+
+  import inspect
 
-  return wrapper
+  target = parser if inspect.isclass(parser) or inspect.isroutine(parser) \
+      else type(parser)
+  try:
+    with open(inspect.getsourcefile(target)) as fin:
+      return hashlib.sha1(fin.read()).hexdigest()
+  except (IOError, TypeError):
+    return repr(target)
 
 
 def __example_loader__(opts):
@@ -66,8 +221,8 @@ def __example_loader__(opts):
     yield parser
 
 
-@memoize
-def available_parsers(opts):
+@ParserCache
+def available_parsers(opts, names=None):
   """ Import all available parsers
 
   Parsers are searched for in the logparser.parsers
@@ -76,10 +231,28 @@ def available_parsers(opts):
   data parsed from it or raises a ValueError if the line
   doesn't contain relevant data.
 
+  A parser which matches a line but can't convert what it
+  matched should raise ConversionError, so that the line is
+  skipped rather than the parse stopped.
+
+  Raising an exception for every line that doesn't match
+  is expensive, so a parser can also provide a `match'
+  callable which returns None for such lines instead. It is
+  used in preference to calling the parser (see `matcher').
+
+  A parser can also provide a `batch' callable, which is given
+  a list of lines and returns an (index, data) pair for each
+  line it matches, in order. Blocks of lines are then parsed
+  with one call rather than one per line. Parsers without it
+  are applied to each line of the block in turn (see
+  logparser.dispatch.Dispatcher).
+
   Since parsers are just callables, it's perfectly reasonable
   to have them be methods on an instance. The same instance
   will then be used on each line, allowing complicated parsers
-  which save state to be used
+  which save state to be used. Such parsers must set a true
+  `stateful' attribute, otherwise large files may be split up
+  and parsed in pieces by different processes.
 
   Parsers are loaded in one of two ways:
 
@@ -99,24 +272,119 @@ def available_parsers(opts):
     __parser__ definition for the parser. This should be
     a tuple containing the name of the parser and a
     callable as described above.
-  """
 
-  parsers = {}
-  for loader, name, ispkg in pkgutil.iter_modules(__path__):
+  A module which defines parsers in several separate files
+  (like SimpleRegex) can also provide `__sources__(opts)',
+  listing the paths of those files, and
+  `__load_source__(opts, path)', which yields (name, parser)
+  tuples for just one of them.
+
+  The parsers are cached for each set of options (see
+  ParserCache), so calling this again is cheap. Different
+  options give freshly loaded parsers, and so do stateful
+  parsers on every call.
+
+  If :names: is given, only the modules and files which
+  define those parsers are loaded, as far as the registry
+  of parser names knows (see logparser.registry). Other
+  parsers they define may be returned as well. What a
+  __loader__ yields may depend on the options, so modules
+  with one are always loaded, and if any of :names: still
+  haven't been found, every source skipped is loaded after
+  all.
+  """
 
-    actual_loader = loader.find_module(name)
-    parser = actual_loader.load_module(actual_loader.fullname)
+  registry = Registry()
+  wanted = None if names is None else set(names)
 
-    if hasattr(parser, '__loader__'):
-      for name, cls in parser.__loader__(opts):
-        parsers[name] = cls
-        logger.debug("Loaded {0} for '{1}'".format(cls, name))
+  parsers = {}
+  skipped = []
+
+  def load_from(key, source_stamp, load):
+    found = {}
+    for name, parser in load():
+      parsers[name] = parser
+      found[name] = getattr(parser, 'desc', None)
+      logger.debug("Loaded {0} for '{1}'".format(parser, name))
+    registry.record(key, source_stamp, parsers=found)
+
+  for key, source_stamp, load, trusted in _sources(opts, registry):
+    known = registry.names(key, source_stamp) if trusted else None
+    if known is not None and wanted is not None and not wanted & set(known):
+      skipped.append((key, source_stamp, load))
+      continue
+    load_from(key, source_stamp, load)
+
+  if wanted is not None and wanted - set(parsers) and skipped:
+    logger.debug("{0} not where the registry says. Loading everything."
+                 .format(sorted(wanted - set(parsers))))
+    for key, source_stamp, load in skipped:
+      load_from(key, source_stamp, load)
+
+  registry.save()
+  return parsers
 
-    else:
-      try:
-        parsers[parser.__parser__[0]] = parser.__parser__[1]
-        logger.debug("Loaded {0[1]} for '{0[0]}'".format(parser.__parser__))
-      except:
-        logger.debug("Failed to load parser from %s" % actual_loader.filename)
 
-  return parsers
+def describe_parsers(opts):
+  """ Return the description of every available parser, keyed
+  by name. Only sources which have changed since the registry
+  last saw them are loaded. """
+  registry = Registry()
+  descriptions = {}
+  for key, source_stamp, load, trusted in _sources(opts, registry):
+    known = registry.names(key, source_stamp) if trusted else None
+    if known is None:
+      known = dict((name, getattr(parser, 'desc', None))
+                   for name, parser in load())
+      registry.record(key, source_stamp, parsers=known)
+    descriptions.update(known)
+
+  registry.save()
+  return descriptions
+
+
+def _module_parsers(module, opts):
+  """ Yield (name, parser) for the parsers :module: defines """
+  if hasattr(module, '__loader__'):
+    for name, cls in module.__loader__(opts):
+      yield name, cls
+  elif hasattr(module, '__parser__'):
+    yield module.__parser__
+  else:
+    logger.debug("Failed to load parser from %s" % module.__file__)
+
+
+def _sources(opts, registry):
+  """ Yield (key, stamp, load, trusted) for every place parsers
+  are defined, where load() yields (name, parser) tuples, and
+  :trusted: is whether the names it defines can be taken
+  from the registry. Those of a __loader__ can't, as they may
+  depend on :opts:.
+
+  Modules only have to be imported here if they define
+  parsers in separate files, or if they have changed since
+  the registry last saw them.
+  """
+  for importer, name, ispkg in pkgutil.iter_modules(__path__):
+    loader = importer.find_module(name)
+    module_stamp = stamp(loader.filename)
+    entry = registry.get(name, module_stamp)
+
+    if entry is not None and entry.get('split') is False:
+      load = lambda loader=loader: _module_parsers(
+          loader.load_module(loader.fullname), opts)
+      yield name, module_stamp, load, entry.get('loader') is False
+      continue
+
+    module = loader.load_module(loader.fullname)
+    split = hasattr(module, '__sources__')
+    has_loader = hasattr(module, '__loader__')
+    registry.record(name, module_stamp, split=split, loader=has_loader)
+    if not split:
+      yield (name, module_stamp,
+             functools.partial(_module_parsers, module, opts), not has_loader)
+      continue
+
+    for path in module.__sources__(opts):
+      yield (path, stamp(path),
+             functools.partial(module.__load_source__, opts, path), True)
@@ -1,8 +1,7 @@
 from logparser.parsers import Parser
+from logparser.timestamps import TimestampParser
 
 import re
-from datetime import datetime
-import calendar
 
 
 class PingBound(Parser):
@@ -14,26 +13,69 @@ class PingBound(Parser):
                      "\[lbound: ([0-9.]+), ubound: ([0-9.]+), "
                      "latency: ([0-9.]+)\]")
 
-  _headers = ['time', 'passed', 'lbound', 'ubound', 'latency']
+  timestamp = TimestampParser("%b %d %H:%M:%S.%f")
 
-  def __init__(self, line):
-    fields = line.split()
+  _headers = ['time', 'passed', 'lbound', 'ubound', 'latency']
+  field_types = (('time', 'time'), ('passed', 'int'), ('lbound', 'float'),
+                 ('ubound', 'float'), ('latency', 'float'))
 
-    match = self.regex.search(line)
+  def __init__(self, line, match=None):
+    if match is None:
+      match = self.regex.search(line)
     if not match:
       raise ValueError
 
-    date = datetime.strptime(" ".join(fields[0:3]), "%b %d %H:%M:%S.%f")
-    date = date.replace(year=datetime.today().year)
-
+    fields = line.split()
     self.data = {
-        'time': calendar.timegm(date.utctimetuple()),
+        'time': self.timestamp(" ".join(fields[0:3])),
         'passed': 1 if match.group(1) == 'Passed.' else 0,
         'lbound': float(match.group(2)),
         'ubound': float(match.group(3)),
         'latency': float(match.group(4))
     }
 
+  @classmethod
+  def match(cls, line):
+    """ Parse :line:, returning None if it doesn't contain
+    PingBound output, or if its timestamp or bounds can't be
+    read (which used to make the parser raise ValueError, so
+    the line was skipped) """
+    match = cls.regex.search(line)
+    if not match:
+      return None
+    try:
+      return cls(line, match)
+    except ValueError:
+      return None
+
+  @classmethod
+  def batch(cls, lines):
+    """ Return (index, data) for each of :lines: which
+    contains PingBound output, skipping those `match' would
+
+    >>> lines = ['Aug 21 18:05:04.000 [PingBound] Passed. '
+    ...          '[lbound: 1.0, ubound: 2.0, latency: 1.5]',
+    ...          'Foo 21 18:05:04.000 [PingBound] Passed. '
+    ...          '[lbound: 1.0, ubound: 2.0, latency: 1.5]',
+    ...          'Aug 21 18:05:04.000 [PingBound] Passed. '
+    ...          '[lbound: 1.0.1, ubound: 2.0, latency: 1.5]']
+    >>> [index for index, _ in PingBound.batch(lines)]
+    [0]
+    >>> [PingBound.match(line) is None for line in lines]
+    [False, True, True]
+    """
+    search = cls.regex.search
+    found = []
+    for index, line in enumerate(lines):
+      match = search(line)
+      if not match:
+        continue
+      try:
+        found.append((index, cls(line, match).data))
+      except ValueError:
+        pass
+    return found
+
   @property
   def data(self):
     return self._data
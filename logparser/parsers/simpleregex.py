@@ -1,60 +1,141 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from logparser.parsers import Parser
+from logparser.parsers import ConversionError, Parser
+from logparser.dispatch import matches_in_place, required_literal
+from logparser import timestamps
+from logparser.registry import cache_dir, stamp
 
 import re
-import itertools
-from pkg_resources import resource_listdir, resource_stream
-import yaml
+import json
+import hashlib
+import functools
+import cPickle
 import os
 import os.path as pth
 
+# Bump whenever what is cached about a definition changes.
+CACHE_VERSION = 2
+
 OBJ = lambda **kwargs: type('obj', (object,), kwargs)()
 
 
+class ParsedLine(object):
+  """ The result of a SimpleRegex parser matching a line """
+  __slots__ = ('name', 'headers', 'data')
+
+  def __init__(self, name, headers, data):
+    self.name = name
+    self.headers = headers
+    self.data = data
+
+
+def __sources__(opts):
+  """ List the YAML files regex parsers are defined in: those
+  in the built in `simple' directory, and any listed in the
+  'simpleregex.files' parser option. """
+  builtin = pth.join(pth.dirname(pth.abspath(__file__)), 'simple')
+  sources = [pth.join(builtin, x) for x in sorted(os.listdir(builtin))
+             if x[0] != '.']
+
+  for f in opts.parser_opts.get('simpleregex.files', ()):
+    path = pth.expanduser(f)
+    sources.append(path if pth.isabs(path) else pth.join(os.getcwd(), path))
+
+  return sources
+
+
+def _cache_path(path):
+  return pth.join(cache_dir(), 'simpleregex',
+                  hashlib.sha1(path).hexdigest() + '.pickle')
+
+
+def _read_cache(path):
+  """ Return what was cached for the definitions in :path:,
+  or None """
+  try:
+    with open(_cache_path(path), 'rb') as fin:
+      cached = cPickle.load(fin)
+  except Exception:
+    return None
+
+  if cached.get('version') != CACHE_VERSION or cached.get('path') != path:
+    return None
+  return cached
+
+
+def _write_cache(path, cached):
+  cache = _cache_path(path)
+  tmp = cache + '.{0}.tmp'.format(os.getpid())
+  try:
+    if not pth.isdir(pth.dirname(cache)):
+      os.makedirs(pth.dirname(cache))
+    with open(tmp, 'wb') as fout:
+      cPickle.dump(cached, fout, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, cache)
+  except (IOError, OSError) as e:
+    logger.debug("Couldn't cache the definitions in '{0}': {1}"
+                 .format(path, e))
+
+
+def definitions(path):
+  """ Return (definition, checked) for each valid parser in
+  the YAML file :path:, where :checked: is what SimpleRegex
+  worked out while validating it.
+
+  Validated definitions are cached (see logparser.registry),
+  and reused for as long as the file's contents are the same.
+  Its modification time and size alone can't be trusted, as an
+  edit may leave both unchanged.
+  """
+  cached = _read_cache(path)
+  current = stamp(path)
+  with open(path) as fin:
+    text = fin.read()
+  digest = hashlib.sha1(text).hexdigest()
+
+  if cached is not None and cached['sha1'] == digest:
+    # Only the stamp may need bringing up to date
+    if cached['stamp'] == current:
+      return cached['parsers']
+    parsers = cached['parsers']
+  else:
+    import yaml
+    try:
+      data = yaml.load(text)
+    except Exception as e:
+      logging.info("Skipping '{0}'. Invalid format".format(path))
+      logging.debug("Load Error: {0}".format(e))
+      return []
+
+    parsers = []
+    for i, parser_data in enumerate(data, 1):
+      try:
+        parsers.append((parser_data, SimpleRegex(parser_data).checked))
+      except ValueError as e:
+          logger.debug("Failed to load #{0} parser from {1}: {2}"
+                       .format(i, path, e))
+
+  _write_cache(path, {'version': CACHE_VERSION, 'path': path,
+                      'stamp': current, 'sha1': digest, 'parsers': parsers})
+  return parsers
+
+
+def __load_source__(opts, path):
+  """ Load the simple YAML regex parsers defined in :path: """
+  for parser_data, checked in definitions(path):
+    yield SimpleRegex.Load(parser_data, checked)
+
+
 def __loader__(opts):
   """ Load all of the simple YAML regex parsers.
 
   If 'parsers.simpleregex.files' is provided in :opts:, try and
   load from that path in addition to the built in directory.
   """
-  files = resource_listdir('logparser.parsers', 'simple')
-
-  for f in ('simple/{0}'.format(x) for x in files if x[0] != '.'):
-    with resource_stream('logparser.parsers', f) as fin:
-      try:
-        data = yaml.load(fin)
-      except Exception as e:
-        logging.info("Skipping '{0}'. Invalid format".format(f))
-        logging.debug("Load Error: {0}".format(e))
-        continue
-
-      for i, parser_data in enumerate(data, 1):
-        try:
-          yield SimpleRegex.Load(parser_data)
-        except ValueError as e:
-            logger.debug("Failed to load #{0} parser from {1}: {2}"
-                         .format(i, f, e))
-
-  if 'simpleregex.files' in opts.parser_opts:
-    for f in opts.parser_opts['simpleregex.files']:
-      path = pth.expanduser(f)
-      path = path if pth.isabs(path) else pth.join(os.getcwd(), path)
-      with open(path) as fin:
-        try:
-          data = yaml.load(fin)
-        except Exception as e:
-          logging.info("Skipping '{0}'. Invalid format".format(f))
-          logging.debug("Load Error: {0}".format(e))
-          continue
-
-        for i, parser_data in enumerate(data, 1):
-          try:
-            yield SimpleRegex.Load(parser_data)
-          except ValueError as e:
-              logger.debug("Failed to load #{0} parser from {1}: {2}"
-                           .format(i, f, e))
+  for path in __sources__(opts):
+    for parser in __load_source__(opts, path):
+      yield parser
 
 
 def parse_time(timestring, **opts):
@@ -71,17 +152,8 @@ def parse_time(timestring, **opts):
   >>> parse_time('2/24/2012 4:25:22 PM', fmt='%m/%d/%Y %I:%M:%S %p')
   1330100722
   """
-  import calendar
-  from datetime import datetime as dt
-
-  if 'fmt' not in opts:
-    opts.update(fmt="%b %d %H:%M:%S.%f")
-
-  date = dt.strptime(timestring, opts['fmt'])
-  if date.year == 1900:
-    date = date.replace(year=dt.today().year)
-
-  return calendar.timegm(date.utctimetuple())
+  return timestamps.parse_time(timestring,
+                               opts.get('fmt', timestamps.DEFAULT_FORMAT))
 
 
 def parse_list(string, strip=True, **opts):
@@ -140,9 +212,24 @@ class SimpleRegex(Parser):
       'boolean': lambda x, **opts: True if x == opts['truth'] else False
   }
 
+  # Types which ignore their options can be converted
+  # by calling the builtin directly.
+  PLAIN_TYPES = {
+      'int': int,
+      'float': float,
+      'str': str
+  }
+
   _desc = "None provided"
 
-  def __init__(self, yaml):
+  def __init__(self, yaml, checked=None):
+    """ Validate and set up the parser defined by :yaml:.
+
+      :checked: is the `checked' attribute of a parser made from
+      the same definition before. If it is given, the definition
+      is taken to be valid, and the regular expression isn't
+      compiled until it is first used.
+    """
 
     self._name = yaml['name']
     self._data = {}
@@ -151,31 +238,81 @@ class SimpleRegex(Parser):
     except KeyError:
       pass
 
+    self._pattern = yaml.get('regex')
+    self._regex = self._line_regex = self._scan_regex = None
+
+    if checked is None:
+      self._compile()
+
+      try:
+        self.fields = yaml['fields']
+      except:
+        raise ValueError("No fields provided. Will work, but is useless")
+
+      if len(self.fields) != self._regex.groups:
+        raise ValueError("Number of fields not equivalent to number of "
+                         "patterns in regular expression ({0} vs {1})"
+                         .format(len(self.fields), self._regex.groups))
+
+      for field in self.fields:
+        if field['type'] not in self.TYPES:
+          raise ValueError("Field type '{0}' not recognized."
+                           .format(field['type']))
+
+      checked = {'prefilter': required_literal(self._pattern),
+                 'in_place': matches_in_place(self._pattern)}
+    else:
+      self.fields = yaml['fields']
+
+    self.checked = checked
+    self._headers = tuple(field['name'] for field in self.fields)
+    self._converters = tuple(self.converter(field) for field in self.fields)
+
+    self.prefilter = checked['prefilter']
+    self.in_place = checked['in_place']
+    if self.prefilter is not None and '\n' in self.prefilter:
+      self._scan_literal = None
+    else:
+      self._scan_literal = self.prefilter
+
+  def _compile(self):
+    """ Compile the regular expression, along with the forms
+      of it used for matching lines in place within a larger
+      buffer (see scan) """
     try:
-      self.regex = re.compile(yaml['regex'])
-    except AttributeError:
+      self._regex = re.compile(self._pattern)
+      self._line_regex = re.compile(self._pattern, re.MULTILINE)
+      self._scan_regex = re.compile('^(?:{0})'.format(self._pattern),
+                                    re.MULTILINE)
+    except (AttributeError, TypeError):
       raise ValueError("No regular expression provided")
     except re.error:
       raise ValueError("Invalid regular expression")
+    return self._regex
 
-    try:
-      self.fields = yaml['fields']
-    except:
-      raise ValueError("No fields provided. Will work, but is useless")
-
-    if len(self.fields) != self.regex.groups:
-      raise ValueError("Number of fields not equivalent to number of "
-                       "patterns in regular expression ({0} vs {1})"
-                       .format(len(self.fields), self.regex.groups))
+  @property
+  def regex(self):
+    return self._regex or self._compile()
 
-    for field in self.fields:
-      if field['type'] not in self.TYPES:
-        raise ValueError("Field type '{0}' not recognized."
-                         .format(field['type']))
+  @classmethod
+  def converter(cls, field):
+    """ Return a callable which converts a matched string
+    according to :field:, with its options already bound """
+    if field['type'] in cls.PLAIN_TYPES:
+      return cls.PLAIN_TYPES[field['type']]
+    if field['type'] == 'time':
+      return timestamps.TimestampParser(
+          field.get('fmt', timestamps.DEFAULT_FORMAT))
+    return functools.partial(cls.TYPES[field['type']], **field)
 
   @property
   def headers(self):
-    return [field['name'] for field in self.fields]
+    return self._headers
+
+  @property
+  def field_types(self):
+    """ The (name, type) of each field, in order """
+    return tuple((field['name'], field['type']) for field in self.fields)
 
   def run(self, line):
     """ Actually run the parser. Return an object
@@ -183,37 +320,219 @@ class SimpleRegex(Parser):
       :data: so that we behave pretty much like
       calling __init__ as a regular parser would.
     """
+    parsed = self.match(line)
+    if parsed is None:
+      raise ValueError
+
+    return parsed
+
+  def match(self, line):
+    """ Run the parser, returning None instead of
+      raising ValueError if :line: doesn't match.
+    """
 
-    match = self.regex.match(line)
+    match = (self._regex or self._compile()).match(line)
     if not match:
-      raise ValueError
+      return None
 
-    data = dict(itertools.izip_longest(self.headers, [], fillvalue=None))
+    return ParsedLine(self._name, self._headers, self._convert(match))
 
-    for i, field in enumerate(self.fields, 1):
-      matched = match.group(i)
+  def _convert(self, match):
+    """ Convert the groups of :match: into a record """
+    return dict(zip(self._headers, self._values(match.groups())))
 
+  def _values(self, groups):
+    """ Convert each of :groups: according to its field """
+    try:
+      return [convert(matched)
+              for convert, matched in zip(self._converters, groups)]
+    except:
+      self._conversion_error(groups)
+
+  def _convert_many(self, rows):
+    """ Convert :rows: of groups into records a column at a time,
+      so that timestamps go through TimestampParser.many and other
+      types are converted without a Python loop """
+    try:
+      columns = [convert.many(column) if hasattr(convert, 'many')
+                 else map(convert, column)
+                 for convert, column in zip(self._converters, zip(*rows))]
+    except:
+      # Find the row which failed, to report it
+      for groups in rows:
+        self._values(groups)
+      raise
+
+    headers = self._headers
+    if not columns:
+      return [dict() for _ in rows]
+    return [dict(zip(headers, values)) for values in zip(*columns)]
+
+  def scan(self, buf, start=0, end=None):
+    """ Yield the record for every line of :buf: between
+      :start: and :end: which matches, without splitting it
+      into lines first.
+
+      :buf: can be anything the re module can search, such as
+      an mmap. :start: must be at the beginning of a line.
+      Candidate lines are found by searching for the prefilter
+      literal (or the pattern itself), and each one is then
+      matched in place, exactly as `match' would match it on
+      its own.
+
+      That only holds for patterns without `\A' or lookbehind
+      assertions (see logparser.dispatch.matches_in_place).
+      Parsers loaded from patterns with them have no `scan', and
+      this copies each line out of :buf: to match it instead.
+
+      >>> p = SimpleRegex({'name': 'w', 'regex': r'(\S*)$',
+      ...                  'fields': [{'name': 'word', 'type': 'str'}]})
+      >>> list(p.scan('hello\\nno match\\n'))
+      [{'word': 'hello'}]
+    """
+    if not self.in_place:
+      if end is None:
+        end = len(buf)
+      regex = self.regex
+      pos = start
+      while pos < end:
+        line_end = buf.find('\n', pos, end) + 1 or end
+        matched = regex.match(buf[pos:line_end])
+        if matched:
+          yield self._convert(matched)
+        pos = line_end
+      return
+
+    for _, matched in self._matches(buf, start, end):
+      yield self._convert(matched)
+
+  def batch(self, lines):
+    """ Return (index, record) for each of :lines: which
+      matches. The lines are joined and scanned as one buffer,
+      so lines which can't match cost no Python code at all, and
+      what matched is converted a column at a time.
+      Patterns which don't match in place (see
+      logparser.dispatch.matches_in_place) are matched one line
+      at a time instead.
+
+      >>> lines = ['a x\\n', 'b x\\n', 'c y\\n']
+      >>> fields = [{'name': 'w', 'type': 'str'}]
+      >>> for regex in (r'(\w+) x$', r'\A(\w+) x$'):
+      ...   p = SimpleRegex({'name': 'x', 'regex': regex, 'fields': fields})
+      ...   (p.batch(lines) ==
+      ...    [(i, p.match(l).data) for i, l in enumerate(lines) if p.match(l)])
+      True
+      True
+      >>> fields = [{'name': 'at', 'type': 'time', 'fmt': '%b %d %H:%M:%S'},
+      ...           {'name': 'n', 'type': 'int'}]
+      >>> p = SimpleRegex({'name': 't', 'regex': r'(\w+ \d+ [\d:]+) (\S+)$',
+      ...                  'fields': fields})
+      >>> lines = ['Aug 21 18:05:04 7\\n', 'Aug 21 18:05:05 8\\n']
+      >>> p.batch(lines) == [(i, p.match(l).data) for i, l in enumerate(lines)]
+      True
+      >>> p.batch(['Aug 21 18:05:04 x\\n'])
+      Traceback (most recent call last):
+      ConversionError: Failed to convert 'x' to type 'int'
+      >>> p = SimpleRegex({'name': 'w', 'regex': r'(\S*)$',
+      ...                  'fields': [{'name': 'word', 'type': 'str'}]})
+      >>> p.batch(['hello\\n', 'no match\\n'])
+      [(0, {'word': 'hello'})]
+    """
+    if not self.in_place:
+      found = []
+      for index, line in enumerate(lines):
+        parsed = self.match(line)
+        if parsed is not None:
+          found.append((index, parsed.data))
+      return found
+
+    buf = ''.join(lines)
+    count = buf.count
+
+    indices = []
+    rows = []
+    index = pos = 0
+    for line_start, matched in self._matches(buf):
+      if line_start >= len(buf):
+        # There is no line here, so nothing to number
+        break
+      index += count('\n', pos, line_start)
+      pos = line_start
+      indices.append(index)
+      rows.append(matched.groups())
+    return zip(indices, self._convert_many(rows))
+
+  def _matches(self, buf, start=0, end=None):
+    """ Yield (line start, match) for every line of :buf:
+      between :start: and :end: which matches (see scan) """
+    if end is None:
+      end = len(buf)
+
+    if self._regex is None:
+      self._compile()
+
+    find = buf.find
+    rfind = buf.rfind
+    match = self._line_regex.match
+    literal = self._scan_literal
+    search = self._scan_regex.search
+
+    pos = start
+    while pos < end:
+      if literal is not None:
+        hit = find(literal, pos, end)
+        if hit < 0:
+          return
+        line_start = rfind('\n', pos, hit) + 1 or pos
+      else:
+        candidate = search(buf, pos, end)
+        # A pattern which can match nothing matches at :end:,
+        # after the last newline, where there is no line
+        if candidate is None or candidate.start() >= end:
+          return
+        hit = line_start = candidate.start()
+
+      line_end = find('\n', hit, end) + 1 or end
+      matched = match(buf, line_start, line_end)
+      if matched:
+        yield line_start, matched
+      pos = line_end
+
+  def _conversion_error(self, groups):
+    """ Raise a ConversionError naming the first of :groups:
+    which can't be converted """
+    for convert, matched, field in zip(self._converters, groups,
+                                       self.fields):
       try:
-        data[field['name']] = self.TYPES[field['type']](matched, **field)
+        convert(matched)
       except:
-        raise TypeError("Failed to convert '{0}' to type '{1}'"
-                        .format(matched, field['type']))
-
-    return OBJ(data=data, name=self.name, headers=self.headers)
+        raise ConversionError("Failed to convert '{0}' to type '{1}'"
+                              .format(matched, field['type']))
+    raise ConversionError("Failed to convert {0}".format(groups))
 
   @classmethod
-  def Load(cls, parser_data):
-    """ Load a SimpleRegex parser from :parser_data:
+  def Load(cls, parser_data, checked=None):
+    """ Load a SimpleRegex parser from :parser_data:, which
+      has already been validated if :checked: is given.
 
       Return the appropriate callable for use with
       __loader__
     """
-    parser = SimpleRegex(parser_data)
+    parser = SimpleRegex(parser_data, checked)
+    definition = json.dumps(parser_data, sort_keys=True, default=str)
 
     # We return a special object that encapsulates a bound method
     # specific to this instance and provides access to the
     # properties of the instance
+    # Parsers which have to see each line on its own are left
+    # to the per-line path
     runner = OBJ(name=parser.name,
                  desc=parser._desc,
+                 prefilter=parser.prefilter,
+                 match=parser.match,
+                 scan=parser.scan if parser.in_place else None,
+                 batch=parser.batch if parser.in_place else None,
+                 field_types=parser.field_types,
+                 signature=hashlib.sha1(definition).hexdigest(),
                  __call__=parser.run)
     return (parser.name, runner)
@@ -0,0 +1,220 @@
+""" Parsing files in a pipeline of threads.
+
+Parsing a file one line after another leaves the disk idle
+while lines are parsed, and the parser idle while the disk is
+read or the output is written. The pipeline splits the work
+into stages which run in their own threads:
+
+  - finding files and planning what to parse of each
+  - reading (and decompressing) several files at once
+  - running the parsers over each block of lines read
+  - handing the records to the writer, which serializes and
+    writes them
+
+Stages are connected by bounded queues, so a slow stage (most
+often the output) holds back the ones before it rather than
+letting blocks of lines pile up in memory. Blocks of lines
+from different files are interleaved, which keeps the parser
+busy when there are many small files.
+
+Only one stage runs Python code at a time, so this helps most
+when reading or writing is slow. Parsing in several processes
+(`parse -j') is what makes parsing itself faster.
+"""
+import os
+import Queue
+import threading
+
+from logparser import compressed
+from logparser.core import _plain_blocks, progress_bar, warn_empty
+from logparser.dispatch import Dispatcher
+
+import logging
+logger = logging.getLogger(__name__)
+
+# How many files are read at once.
+READERS = 4
+
+# How many blocks of lines (or of records) may wait between
+# two stages before the earlier one has to wait.
+QUEUE_DEPTH = 16
+
+
+class _Stopped(Exception):
+  """ Raised in a stage when another one has failed """
+
+
+class Pipeline(object):
+  """ Parse (identifier, path, start, end) jobs with :parsers:
+  and hand the records to :writer:.
+
+  :readers: files are read at once. Parsers which keep state
+  between lines have to see each file's lines without those of
+  other files mixed in, so pass 1 if any of them do. What each
+  parser costs is added to :stats: if it is given.
+  """
+
+  def __init__(self, parsers, writer, readers=READERS, show_progress=True,
+               depth=QUEUE_DEPTH, stats=None):
+    self.parsers = parsers
+    self.stats = stats
+    self.names = sorted(parsers)
+    self.writer = writer
+    self.readers = readers
+    self.show_progress = show_progress
+
+    self.jobs = Queue.Queue(readers)
+    self.blocks = Queue.Queue(depth)
+    self.records = Queue.Queue(depth)
+    self.stop = threading.Event()
+    self.errors = []
+    self.seen = {'paths': set(), 'total': 0}
+
+  def _put(self, queue, item):
+    while not self.stop.is_set():
+      try:
+        queue.put(item, timeout=0.1)
+        return
+      except Queue.Full:
+        pass
+    raise _Stopped()
+
+  def _get(self, queue):
+    while not self.stop.is_set():
+      try:
+        return queue.get(timeout=0.1)
+      except Queue.Empty:
+        pass
+    raise _Stopped()
+
+  def _stage(self, fn, *args):
+    """ Run :fn: in a thread. If it fails, every other stage
+    is stopped and the error is raised by run(). """
+    def run():
+      try:
+        fn(*args)
+      except _Stopped:
+        pass
+      except Exception as e:
+        logger.debug("Pipeline stage {0} failed".format(fn.__name__),
+                     exc_info=True)
+        self.errors.append(e)
+        self.stop.set()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+  def _feed(self, jobs):
+    for job in jobs:
+      _, path, start, end = job
+      self.seen['paths'].add(path)
+      self.seen['total'] += (os.path.getsize(path) if end is None
+                             else end) - start
+      self._put(self.jobs, job)
+
+    for _ in xrange(self.readers):
+      self._put(self.jobs, None)
+
+  def _read(self):
+    """ Queue (job, lines, read) for each block of each file,
+    then (job, None, 0) once the file has been read. (None,
+    None, 0) means this reader has finished. """
+    while True:
+      job = self._get(self.jobs)
+      if job is None:
+        self._put(self.blocks, (None, None, 0))
+        return
+
+      identifier, path, start, end = job
+      kind = compressed.detect(path)
+      if kind is None:
+        source = open(path)
+        blocks = _plain_blocks(source, start, end)
+      else:
+        source = compressed.CompressedReader(path, kind, start, end)
+        blocks = source.blocks()
+
+      with source:
+        for block, read in blocks:
+          self._put(self.blocks, (job, block, read))
+
+      if kind is not None and source.truncated:
+        logger.warn("'{0}' ends part way through a compressed stream"
+                    .format(identifier))
+      self._put(self.blocks, (job, None, 0))
+
+  def _parse(self):
+    """ Parse each block of lines into records, and queue
+    (job, records), or (job, None) once a file is done """
+    dispatch = Dispatcher(self.parsers, self.stats)
+    bar = None
+    if self.show_progress:
+      bar = progress_bar('0 files ', 0)
+      bar.start()
+
+    parsed = 0
+    finished = 0
+    while finished < self.readers:
+      job, block, read = self._get(self.blocks)
+      if job is None:
+        finished += 1
+        continue
+      if block is None:
+        self._put(self.records, (job, None))
+        continue
+
+      data = dict((name, []) for name in self.names)
+      dispatch.block(block, data)
+      self._put(self.records, (job, data))
+
+      parsed += read
+      if bar is not None:
+        bar.widgets[0] = '{0} files '.format(len(self.seen['paths']))
+        bar.maxval = max(self.seen['total'], 1)
+        bar.update(min(parsed, bar.maxval))
+
+    self._put(self.records, None)
+    if bar is not None:
+      bar.finish()
+
+  def _write(self):
+    while True:
+      item = self._get(self.records)
+      if item is None:
+        return
+
+      job, data = item
+      identifier, _, start, end = job
+      output = self.writer.file(identifier, self.names)
+      if data is None:
+        if start == 0 and end is None:
+          warn_empty(output)
+        self.writer.done(identifier)
+        continue
+
+      for name, records in data.iteritems():
+        if records:
+          output[name].extend(records)
+
+  def run(self, jobs):
+    """ Parse every job in the iterable :jobs:. Returns once
+    all the records have been handed to the writer. """
+    threads = [self._stage(self._feed, jobs)]
+    threads.extend(self._stage(self._read) for _ in xrange(self.readers))
+    writing = self._stage(self._write)
+
+    try:
+      self._parse()
+      while writing.is_alive():
+        writing.join(0.1)
+    except _Stopped:
+      pass
+    finally:
+      self.stop.set()
+      for thread in threads + [writing]:
+        thread.join()
+
+    if self.errors:
+      raise self.errors[0]
@@ -0,0 +1,246 @@
+""" Grouped counts, sums, means, extremes and quantiles of the
+records of one parser.
+
+The output of `parse' is split into pieces (see
+util.split_records), which worker processes read in parallel.
+Each folds the records of its piece into a partial Aggregation:
+for each group, a count and, for each column, a sum, minimum,
+maximum and QuantileSketch. Partial aggregations are merged as
+they come back, so memory depends on how many groups there are
+rather than how many records.
+"""
+import fnmatch
+import math
+import multiprocessing
+
+import logparser.postprocess.util as util
+from logparser.postprocess.sketch import ACCURACY, QuantileSketch
+
+import logging
+logger = logging.getLogger(__name__)
+
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# The values which are aggregated. Checking for these is much
+# quicker than for numbers.Real.
+NUMBERS = (int, long, float)
+
+
+class ColumnState(object):
+  """ The partial aggregates of one column of one group. Values
+  which aren't finite numbers are left out; booleans count as
+  0 or 1. """
+
+  def __init__(self, accuracy=ACCURACY):
+    self.count = 0
+    self.total = 0
+    self.low = None
+    self.high = None
+    self.sketch = QuantileSketch(accuracy)
+
+  def add(self, value):
+    if not isinstance(value, NUMBERS):
+      return
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+      return
+    if isinstance(value, bool):
+      value = int(value)
+
+    self.count += 1
+    self.total += value
+    if self.low is None or value < self.low:
+      self.low = value
+    if self.high is None or value > self.high:
+      self.high = value
+    self.sketch.add(value)
+
+  def merge(self, other):
+    if not other.count:
+      return
+    self.count += other.count
+    self.total += other.total
+    if self.low is None or other.low < self.low:
+      self.low = other.low
+    if self.high is None or other.high > self.high:
+      self.high = other.high
+    self.sketch.merge(other.sketch)
+
+  def result(self, aggregate):
+    """ Return :aggregate: (one of AGGREGATES other than
+    `count', or a quantile), or None if there are no values """
+    if not self.count:
+      return None
+    if aggregate == 'sum':
+      return self.total
+    if aggregate == 'mean':
+      return float(self.total) / self.count
+    if aggregate == 'min':
+      return self.low
+    if aggregate == 'max':
+      return self.high
+    # Keep estimates within the values actually seen
+    return min(max(self.sketch.quantile(aggregate), self.low), self.high)
+
+
+class Aggregation(object):
+  """ Partial aggregates of :columns: over records grouped by
+  the values of the columns :by:, where `file_' is the file a
+  record came from.
+
+  >>> agg = Aggregation(['file_'], ['latency'])
+  >>> for latency in (10, 20, 30):
+  ...   agg.add('a.log', {'latency': latency})
+  >>> other = Aggregation(['file_'], ['latency'])
+  >>> other.add('a.log', {'latency': 'n/a'})
+  >>> agg.merge(other)
+  >>> count, columns = agg.groups[('a.log',)]
+  >>> count, columns['latency'].count, columns['latency'].result('mean')
+  (4, 3, 20.0)
+  """
+
+  def __init__(self, by, columns, accuracy=ACCURACY):
+    self.by = by
+    self.columns = columns
+    self.accuracy = accuracy
+    self.groups = {}
+
+  def _group(self, key):
+    group = self.groups.get(key)
+    if group is None:
+      group = self.groups[key] = [0, dict((name, ColumnState(self.accuracy))
+                                          for name in self.columns)]
+    return group
+
+  def add(self, fname, record):
+    key = tuple(fname if name == 'file_' else record.get(name)
+                for name in self.by)
+    group = self._group(key)
+    group[0] += 1
+    for name, state in group[1].iteritems():
+      state.add(record.get(name))
+
+  def merge(self, other):
+    """ Add the partial aggregates of the Aggregation :other: """
+    for key, (count, columns) in other.groups.iteritems():
+      group = self._group(key)
+      group[0] += count
+      for name, state in columns.iteritems():
+        group[1][name].merge(state)
+
+  def headers(self, aggregates, quantiles):
+    headers = list(self.by)
+    if 'count' in aggregates:
+      headers.append('count')
+    for name in self.columns:
+      headers.extend('{0}_{1}'.format(name, aggregate)
+                     for aggregate in aggregates if aggregate != 'count')
+      headers.extend('{0}_{1}'.format(name, quantile_name(q))
+                     for q in quantiles)
+    return headers
+
+  def rows(self, aggregates, quantiles):
+    """ Yield a row of results per group, in the order of
+    headers() and sorted by group """
+    for key in sorted(self.groups):
+      count, columns = self.groups[key]
+      row = [str(value) for value in key]
+      if 'count' in aggregates:
+        row.append(str(count))
+      for name in self.columns:
+        state = columns[name]
+        results = [state.result(aggregate)
+                   for aggregate in aggregates if aggregate != 'count']
+        results.extend(state.result(q) for q in quantiles)
+        row.extend('NA' if value is None else str(value)
+                   for value in results)
+      yield row
+
+
+def quantile_name(q):
+  """
+  >>> [quantile_name(q) for q in (0.5, 0.99, 0.999)]
+  ['p50', 'p99', 'p99.9']
+  """
+  return 'p{0:g}'.format(q * 100)
+
+
+def _aggregate_piece(task):
+  """ Aggregate the records of one piece inside a pool
+  worker """
+  piece, filefilter, parser, by, columns, accuracy = task
+  aggregation = Aggregation(by, columns, accuracy)
+  records = util.read_piece(piece, filefilter, parser)
+  for fname, dp in util.filter_records(records, filefilter, parser):
+    aggregation.add(fname, dp)
+  return aggregation
+
+
+def _first_record(pieces, filefilter, parser):
+  """ Return the parser to aggregate (:parser:, or that of the
+  first record if it is None) and its first record in a file
+  matching :filefilter:, or None if there isn't one """
+  for piece in pieces:
+    records = util.read_piece(piece, filefilter, parser)
+    for fname, record_parser, dp in records:
+      if parser is None:
+        parser = record_parser
+      if record_parser == parser and fnmatch.fnmatch(fname, filefilter):
+        return parser, dp
+  return parser, None
+
+
+def aggregate(args):
+  """ Print grouped aggregates of the records from one parser
+  in an output file """
+  quantiles = args.quantile or QUANTILES
+  if any(q < 0 or q > 1 for q in quantiles):
+    logger.error("Quantiles have to be between 0 and 1")
+    raise RuntimeError()
+  if not 0 < args.accuracy < 1:
+    logger.error("The accuracy has to be between 0 and 1")
+    raise RuntimeError()
+  aggregates = args.aggregates or AGGREGATES
+  by = [name for name in args.by or ['file_'] if name]
+
+  pieces = util.split_records(args.input, args.f, args.p)
+  parser, first = _first_record(pieces, args.f, args.p)
+  if first is None:
+    logger.warn("No records matched")
+    return
+
+  columns = args.column
+  if not columns:
+    # Quantiles of timestamps are only accurate to within a
+    # fraction of the time since the epoch, so they are left out
+    types = dict(util.field_types(args.input, parser, args))
+    columns = sorted(key for key, val in first.iteritems()
+                     if isinstance(val, NUMBERS) and key not in by
+                     and types.get(key) != 'time')
+
+  tasks = [(piece, args.f, parser, by, columns, args.accuracy)
+           for piece in pieces]
+  processes = min(args.jobs or multiprocessing.cpu_count(), len(tasks))
+  logger.debug("Aggregating {0} pieces of '{1}' in {2} processes"
+               .format(len(tasks), args.input, processes))
+
+  total = Aggregation(by, columns, args.accuracy)
+  if processes <= 1:
+    for task in tasks:
+      total.merge(_aggregate_piece(task))
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      for partial in pool.imap_unordered(_aggregate_piece, tasks):
+        total.merge(partial)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+
+  print(" ".join(total.headers(aggregates, quantiles)))
+  for row in total.rows(aggregates, quantiles):
+    print(" ".join(row))
@@ -1,31 +1,48 @@
-import json
 import logparser.postprocess.util as util
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def flatten(args):
-  """ Flatten an output file to create tabular data """
+def flat_rows(path, filefilter, parser=None):
+  """ Yield the headers and then each row of the table that
+  `flatten' prints for the records of :parser: in files matching
+  :filefilter: in the output at :path:, as lists of strings.
+  Nothing is yielded if no records match.
+  """
+  if util.is_columnar(path):
+    flattened = util.load_columnar(path, filefilter, parser, label_files=True)
+    if flattened is None:
+      return
+    yield flattened.headers
+    for row in flattened.by_row(convert=str):
+      yield row
+    return
+
+  # If no parser is given, this takes the first one
+  records = util.open_records(path, filefilter, parser)
+  records = util.filter_records(records, filefilter, parser)
 
-  try:
-    with open(args.input) as fin:
-      data = json.load(fin)
-  except Exception as e:
-    logger.error("Invalid input file. Expected JSON")
-    logger.debug("JSON Error: {0}".format(e))
-    raise RuntimeError()
-  except IOError as e:
-    logger.error("Could not read '{0}'".format(args.input))
-    logger.debug("IOError: {0}".format(e))
-    raise RuntimeError()
+  headers = None
+  for fname, dp in records:
+    if headers is None:
+      headers = util.record_headers(dp, label_files=True)
+      yield headers
+      columns = headers[:-1]
 
-  # Get the first one
-  parser = data.values()[0].keys()[0] if args.p is None else args.p
+    yield [str(dp[key]) for key in columns] + [str(fname)]
 
-  flattened = util.filter_and_flatten(data, args.f, parser, label_files=True)
 
-  print(" ".join(flattened.headers))
+def flatten(args):
+  """ Flatten an output file to create tabular data.
 
-  for row in flattened.by_row(convert=str):
+  Rows are written as the records are read, so the output
+  starts before the whole file has been read.
+  """
+  matched = False
+  for row in flat_rows(args.input, args.f, args.p):
     print(" ".join(row))
+    matched = True
+
+  if not matched:
+    logger.warn("No records matched")
@@ -1,5 +1,4 @@
 import logparser.postprocess.util as util
-import json
 
 import logging
 logger = logging.getLogger(__name__)
@@ -43,21 +42,8 @@ def get_ggplot_args(argparse_args):
 def plot(args):
   """ Plot data parsed from logfiles previously """
 
-  try:
-    with open(args.input) as fin:
-      data = json.load(fin)
-  except IOError as e:
-    logger.error("Could not read '{0}'".format(args.input))
-    logger.debug("IOError: {0}".format(e))
-    raise RuntimeError()
-  except Exception as e:
-    logger.error("Invalid input file. Expected JSON")
-    logger.debug("JSON Error: {0}".format(e))
-    raise RuntimeError()
-
-  # Get the first one
-  parser = data.values()[0].keys()[0] if args.p is None else args.p
-  dataf = util.filter_and_flatten(data, args.f, parser, label_files=True)
+  # If no parser is given, this takes the first one
+  dataf = util.load_dataframe(args.input, args.f, args.p, label_files=True)
 
   r_dataf = ro.DataFrame(dataf.asRObjects)
   gp = ggplot2.ggplot(r_dataf)
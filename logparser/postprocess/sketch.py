@@ -0,0 +1,124 @@
+""" Estimating quantiles in bounded memory.
+
+QuantileSketch counts values in buckets whose bounds grow
+geometrically, as in DDSketch (Masson, Rim and Lee, 2019), so
+every quantile it returns is within a fixed relative error of
+the true one. Sketches of different parts of the data can be
+merged into a sketch of the whole, which is what lets
+`aggregate' work on files in parallel.
+"""
+import math
+
+# The relative error of the quantiles returned.
+ACCURACY = 0.01
+
+# How many buckets each sign of value may use. At 1% accuracy
+# 2048 buckets cover values from 1 to about 1e17, so in
+# practice they are never collapsed.
+MAX_BUCKETS = 2048
+
+# Smaller values are counted as zero.
+MIN_VALUE = 1e-9
+
+
+class QuantileSketch(object):
+  """ Estimate quantiles of a stream of numbers to within
+  :accuracy: of their value.
+
+  If either sign of value needs more than :max_buckets:
+  buckets, the buckets of the smallest magnitudes are
+  collapsed together, which only makes the quantiles nearest
+  zero less accurate.
+
+  >>> sketch = QuantileSketch()
+  >>> for value in xrange(1, 1001):
+  ...   sketch.add(value)
+  >>> other = QuantileSketch()
+  >>> other.add(-5)
+  >>> sketch.merge(other)
+  >>> sketch.count
+  1001
+  >>> abs(sketch.quantile(0.5) - 500) <= 500 * ACCURACY
+  True
+  >>> abs(sketch.quantile(0) + 5) <= 5 * ACCURACY
+  True
+  """
+
+  def __init__(self, accuracy=ACCURACY, max_buckets=MAX_BUCKETS):
+    self.accuracy = accuracy
+    self.gamma = (1 + accuracy) / (1 - accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.max_buckets = max_buckets
+    self.positive = {}
+    self.negative = {}
+    self.zeros = 0
+    self.count = 0
+
+  # Values go in bucket ceil(log(value, gamma)), so bucket k
+  # holds values between gamma ** (k - 1) and gamma ** k.
+
+  def _value(self, key):
+    """ The value a bucket stands for, which is within
+    `accuracy' of any value in it """
+    return 2 * self.gamma ** key / (self.gamma + 1)
+
+  def add(self, value, count=1):
+    """ Count the finite number :value: :count: times """
+    if value > MIN_VALUE:
+      store = self.positive
+      key = int(math.ceil(math.log(value) / self.log_gamma))
+    elif value < -MIN_VALUE:
+      store = self.negative
+      key = int(math.ceil(math.log(-value) / self.log_gamma))
+    else:
+      self.zeros += count
+      self.count += count
+      return
+
+    store[key] = store.get(key, 0) + count
+    self.count += count
+    if len(store) > self.max_buckets:
+      self._collapse(store)
+
+  def _collapse(self, store):
+    keys = sorted(store)
+    excess = len(keys) - self.max_buckets
+    lowest = keys[excess]
+    for key in keys[:excess]:
+      store[lowest] += store.pop(key)
+
+  def merge(self, other):
+    """ Add the values counted by the QuantileSketch :other: """
+    if other.accuracy != self.accuracy:
+      raise ValueError("Can't merge sketches of different accuracy")
+
+    for store, theirs in ((self.positive, other.positive),
+                          (self.negative, other.negative)):
+      for key, count in theirs.iteritems():
+        store[key] = store.get(key, 0) + count
+      if len(store) > self.max_buckets:
+        self._collapse(store)
+    self.zeros += other.zeros
+    self.count += other.count
+
+  def quantile(self, q):
+    """ Return the estimated :q: quantile (0 <= q <= 1), or
+    None if nothing has been counted """
+    if not self.count:
+      return None
+
+    rank = q * (self.count - 1)
+    seen = 0
+    for key in sorted(self.negative, reverse=True):
+      seen += self.negative[key]
+      if seen > rank:
+        return -self._value(key)
+
+    seen += self.zeros
+    if seen > rank:
+      return 0.0
+
+    for key in sorted(self.positive):
+      seen += self.positive[key]
+      if seen > rank:
+        return self._value(key)
@@ -1,7 +1,51 @@
+import array
 import fnmatch
+import itertools
+import json
+import numbers
+import os.path
+import re
+from logparser.output import infer_field_types, read_index
 import logging
 logger = logging.getLogger(__name__)
 
+# array.array typecodes for numeric field types. Both take 8
+# bytes per value on 64-bit platforms.
+TYPECODES = {
+    'int': 'l',
+    'time': 'l',
+    'float': 'd'
+}
+
+# The types of value each array typecode holds without changing
+# them. An array('d') also takes ints, but reads them back as
+# floats, and an array('l') takes booleans.
+ARRAY_TYPES = {
+    'l': frozenset([int, long]),
+    'd': frozenset([float])
+}
+
+# Field types which are dictionary-encoded, and the values they
+# may hold.
+ENCODED = {
+    'str': basestring,
+    'boolean': bool
+}
+
+# How many records flatten_records collects before appending
+# them to a DataFrame.
+BULK_ROWS = 10000
+
+# How many bytes of a JSON document are read at a time when
+# streaming its records.
+READ_SIZE = 64 * 1024
+
+# How many bytes of JSON Lines output split_records puts in
+# each piece.
+PIECE_SIZE = 16 * 1024 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
 
 class Namespace(dict):
   def __init__(self, d):
@@ -17,7 +61,128 @@ class Namespace(dict):
     return rep
 
 
+class DictColumn(object):
+  """ A column of strings stored as integer :codes: into
+  an array of the distinct values, :categories:
+
+  >>> column = DictColumn.empty(basestring)
+  >>> column.extend(['a', 'b', 'a'])
+  >>> list(column), list(column.codes), column.categories
+  (['a', 'b', 'a'], [0, 1, 0], ['a', 'b'])
+  """
+
+  def __init__(self, codes, categories, kind=None):
+    self.codes = codes
+    self.categories = categories
+    self.kind = kind
+    self.index = None
+
+  @classmethod
+  def empty(cls, kind=None):
+    """ Return an empty column which can be extended. If :kind:
+    is given, only values which are instances of it can be
+    added. """
+    return cls(array.array('i'), [], kind)
+
+  def extend(self, values):
+    """ Append :values:, raising TypeError (and leaving the
+    column as it was) if any of them aren't of its kind """
+    if self.index is None:
+      self.index = dict((val, code)
+                        for code, val in enumerate(self.categories))
+    index = self.index
+    categories = self.categories
+    kind = self.kind
+
+    codes = []
+    for val in values:
+      if kind is not None and not isinstance(val, kind):
+        raise TypeError("Can't add {0!r} to a column of {1}"
+                        .format(val, kind.__name__))
+      code = index.get(val)
+      if code is None:
+        code = index[val] = len(categories)
+        categories.append(val)
+      codes.append(code)
+    self.codes.extend(codes)
+
+  def __getitem__(self, i):
+    return self.categories[self.codes[i]]
+
+  def __len__(self):
+    return len(self.codes)
+
+  def __iter__(self):
+    categories = self.categories
+    for code in self.codes:
+      yield categories[code]
+
+  @classmethod
+  def concatenate(cls, columns):
+    """ Join several DictColumns into one, merging
+    their categories """
+    import numpy
+
+    merged = {}
+    codes = []
+    for column in columns:
+      remap = numpy.array([merged.setdefault(val, len(merged))
+                           for val in column.categories], dtype='int32')
+      codes.append(remap[column.codes] if len(remap) else column.codes)
+
+    categories = sorted(merged, key=merged.get)
+    return cls(numpy.concatenate(codes), numpy.array(categories))
+
+
+def new_column(ftype):
+  """ Return an empty column for values of the field type
+  :ftype:. Numbers are kept in arrays and strings are
+  dictionary-encoded; anything else is kept in a list. """
+  if ftype in TYPECODES:
+    return array.array(TYPECODES[ftype])
+  if ftype in ENCODED:
+    return DictColumn.empty(ENCODED[ftype])
+  return []
+
+
+def _extend(column, values):
+  """ Append :values: to :column:, and return the column. A
+  typed column which can't hold them all, exactly as they are,
+  is turned into a list.
+
+  >>> _extend(new_column('float'), [1.5, 2])
+  [1.5, 2]
+  """
+  size = len(column)
+  try:
+    if isinstance(column, array.array):
+      if not set(map(type, values)) <= ARRAY_TYPES[column.typecode]:
+        raise TypeError("Not all values fit array('{0}')"
+                        .format(column.typecode))
+    column.extend(values)
+    return column
+  except (TypeError, OverflowError):
+    if isinstance(column, array.array):
+      del column[size:]
+    logger.debug("Storing a column of {0} values as a list"
+                 .format(type(values[0]).__name__ if values else 'no'))
+    return [val for val in column] + values
+
+
 class DataFrame(object):
+  """ A table of parsed records, stored as one column per
+  header.
+
+  If :field_types: ((name, type) pairs, like the
+  `field_types' of a parser) are given, numeric columns are
+  stored in arrays and string columns are dictionary-encoded
+  (see new_column). Other columns are lists.
+
+  >>> frame = DataFrame(['n', 'who'], (('n', 'int'), ('who', 'str')))
+  >>> frame.extend([{'n': 1, 'who': 'bob'}, {'n': 2, 'who': 'bob'}])
+  >>> frame.raw['n'], list(frame.by_row(convert=str))
+  (array('l', [1, 2]), [['1', 'bob'], ['2', 'bob']])
+  """
 
   @property
   def headers(self):
@@ -32,33 +197,52 @@ class DataFrame(object):
     import rpy2.robjects as ro
     conv = {}
     for key in self.headers:
-      if isinstance(self.raw[key][0], (int)):
-        conv[key] = ro.IntVector(self.raw[key])
-      elif isinstance(self.raw[key][0], (float)):
-        conv[key] = ro.FloatVector(self.raw[key])
+      if isinstance(self.raw[key][0], (numbers.Integral)):
+        conv[key] = ro.IntVector(list(self.raw[key]))
+      elif isinstance(self.raw[key][0], (numbers.Real)):
+        conv[key] = ro.FloatVector(list(self.raw[key]))
       elif isinstance(self.raw[key][0], (basestring)):
-        conv[key] = ro.StrVector(self.raw[key])
+        conv[key] = ro.StrVector(list(self.raw[key]))
       else:
         logger.warn("Failed to convert '{0}' to R Vector".format(key))
 
     return conv
 
-  def __init__(self, headers):
+  def __init__(self, headers, field_types=None):
     self._headers = headers
 
-    self._data = dict(((x, list()) for x in headers))
+    types = dict(field_types or ())
+    self._data = dict(((x, new_column(types.get(x))) for x in headers))
     self.row_count = 0
 
+  @classmethod
+  def from_columns(cls, headers, columns):
+    """ Build a DataFrame around existing :columns:, keyed
+    by header. Columns can be anything indexable, such as
+    lists or (memory-mapped) NumPy arrays.
+    """
+    frame = cls(headers)
+    frame._data = dict(columns)
+    frame.row_count = len(columns[headers[0]]) if headers else 0
+    return frame
+
   def add_row(self, allow_missing=False, **kwargs):
+    self.extend([kwargs])
+
+  def extend(self, records, **constants):
+    """ Append a row for each of :records:, a list of
+    dictionaries keyed by header. Headers given in :constants:
+    have that value in every row. """
+    columns = []
     for key in self.headers:
-      try:
-        self._data[key].append(kwargs[key])
-      except:
-        if allow_missing:
-          pass
-        raise
+      if key in constants:
+        columns.append((key, [constants[key]] * len(records)))
+      else:
+        columns.append((key, [record[key] for record in records]))
 
-    self.row_count += 1
+    for key, values in columns:
+      self._data[key] = _extend(self._data[key], values)
+    self.row_count += len(records)
 
   def by_row(self, limit=None, convert=None):
     limit = self.row_count if limit is None else limit
@@ -72,31 +256,568 @@ class DataFrame(object):
     return self.row_count
 
 
-def filter_and_flatten(json_data, filefilter, parser, label_files=False):
-  """ Return a filtered set of the :json_data:.
+class _JSONStream(object):
+  """ Read a JSON document a piece at a time, so that the
+  values nested in it can be decoded without holding the whole
+  document in memory.
+
+  >>> import StringIO
+  >>> stream = _JSONStream(StringIO.StringIO('{"a": [1, {"b": 2}]}'))
+  >>> for _ in stream.items('{', '}'):
+  ...   key = stream.key()
+  ...   [stream.value() for _ in stream.items('[', ']')]
+  [1, {u'b': 2}]
+  """
+
+  def __init__(self, fin, read_size=READ_SIZE):
+    self.fin = fin
+    self.read_size = read_size
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+    self.decode = json.JSONDecoder().raw_decode
+
+  def _fill(self):
+    """ Read more of the document. Returns False at its end """
+    if self.eof:
+      return False
+    chunk = self.fin.read(self.read_size)
+    if not chunk:
+      self.eof = True
+      return False
+    self.buf = self.buf[self.pos:] + chunk
+    self.pos = 0
+    return True
+
+  def peek(self):
+    """ Skip whitespace, and return the next character, or ''
+    at the end of the document """
+    while True:
+      self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self._fill():
+        return ''
+
+  def expect(self, chars):
+    """ Consume the next character, which has to be one of
+    :chars:, and return it """
+    char = self.peek()
+    if not char or char not in chars:
+      raise ValueError("Expected one of '{0}' but found {1!r}"
+                       .format(chars, char or 'the end of the input'))
+    self.pos += 1
+    return char
+
+  def value(self):
+    """ Decode and return the next value """
+    self.peek()
+    while True:
+      try:
+        value, end = self.decode(self.buf, self.pos)
+      except ValueError:
+        # The value may be cut off by the end of what was read
+        if not self._fill():
+          raise
+        continue
+      # A number at the end of what was read may go on
+      if end == len(self.buf) and self._fill():
+        continue
+      self.pos = end
+      return value
+
+  def key(self):
+    """ Decode the next key of an object, and its colon """
+    key = self.value()
+    if not isinstance(key, basestring):
+      raise ValueError("Expected an object key but found {0!r}".format(key))
+    self.expect(':')
+    return key
+
+  def items(self, opening, closing):
+    """ Consume an array or object, which starts with :opening:
+    and ends with :closing:. Yields once before each of its
+    members, which the caller has to consume. """
+    self.expect(opening)
+    if self.peek() == closing:
+      self.pos += 1
+      return
+    while True:
+      yield
+      if self.expect(',' + closing) == closing:
+        return
+
+
+def _is_jsonlines(fin):
+  """ Check whether :fin: holds one JSON record per line
+  rather than a single JSON document """
+  first = fin.readline()
+  fin.seek(0)
+  try:
+    record = json.loads(first)
+  except ValueError:
+    return False
+
+  return isinstance(record, dict) and 'parser' in record
+
+
+def _iter_jsonlines(fin, start=0, end=None):
+  """ Yield the records of the lines of :fin: which start
+  between :start: and :end: """
+  with fin:
+    fin.seek(start)
+    pos = start
+    for line in fin:
+      if end is not None and pos >= end:
+        break
+      pos += len(line)
+      if line.strip():
+        record = json.loads(line)
+        yield record['file'], record['parser'], record['data']
+
+
+def _iter_json(json_data):
+  for fname, parsers in json_data.iteritems():
+    for parser, datapoints in parsers.iteritems():
+      for dp in datapoints:
+        yield fname, parser, dp
+
+
+def _invalid_json(e):
+  logger.error("Invalid input file. Expected JSON")
+  logger.debug("JSON Error: {0}".format(e))
+  raise RuntimeError()
+
+
+def _iter_json_stream(fin):
+  """ Yield (file, parser, record) from the JSON document
+  written by `parse' in :fin:, one record at a time """
+  stream = _JSONStream(fin)
+  try:
+    with fin:
+      for _ in stream.items('{', '}'):
+        fname = stream.key()
+        for _ in stream.items('{', '}'):
+          parser = stream.key()
+          for _ in stream.items('[', ']'):
+            yield fname, parser, stream.value()
+      if stream.peek():
+        raise ValueError("Extra data after the end of the document")
+  except ValueError as e:
+    _invalid_json(e)
+
+
+def _json_arrays(fin):
+  """ Return (file, parser, start, end) for each non-empty array
+  of records in the JSON document in :fin:, which lies between
+  bytes :start: and :end:, or None if the document isn't laid out
+  the way `parse' writes it.
+
+  The document isn't decoded: `parse' indents it by two spaces
+  per level, so files and parsers are the only keys indented by
+  two and four, and each array ends on a line of its own.
+
+  >>> import StringIO
+  >>> doc = json.dumps({'a': {'p': [1, 2], 'q': []}}, indent=2)
+  >>> [(f, p, doc[start:end]) for f, p, start, end
+  ...  in _json_arrays(StringIO.StringIO(doc))]
+  [(u'a', u'p', '[\\n      1, \\n      2\\n    ]')]
+  """
+  decode = json.JSONDecoder().raw_decode
+  arrays = []
+  fname = start = None
+  pos = 0
+  for line in fin:
+    if not pos and line != '{\n':
+      return None
+    if line.startswith('  "'):
+      fname = decode(line, 2)[0]
+    elif line.startswith('    "') and line.endswith('[\n'):
+      parser = decode(line, 4)[0]
+      start = pos + len(line) - 2
+    elif line.startswith('    ]') and start is not None:
+      arrays.append((fname, parser, start, pos + 5))
+      start = None
+    pos += len(line)
+  return arrays
+
+
+class _Slice(object):
+  """ The bytes of :fin: from :start: to :end:, read like a file """
+
+  def __init__(self, fin, start, end):
+    fin.seek(start)
+    self.fin = fin
+    self.left = end - start
+
+  def read(self, size):
+    data = self.fin.read(min(size, self.left))
+    self.left -= len(data)
+    return data
+
+
+def _iter_json_array(fin, fname, parser, start, end):
+  """ Yield (file, parser, record) from the array of records of
+  :parser: in :fname: between bytes :start: and :end: of the
+  JSON document in :fin: """
+  stream = _JSONStream(_Slice(fin, start, end))
+  try:
+    with fin:
+      for _ in stream.items('[', ']'):
+        yield fname, parser, stream.value()
+  except ValueError as e:
+    _invalid_json(e)
+
+
+def _sections(index, filefilter, parser):
+  """ Return (file, parser, section) for each section of
+  indexed output which :filefilter: and :parser: select.
+  :parser: defaults to the first parser of the first file. """
+  files = index['files']
+  fnames = fnmatch.filter(sorted(files), filefilter)
+  if parser is None and fnames and files[fnames[0]]:
+    parser = sorted(files[fnames[0]])[0]
+
+  return [(fname, parser, files[fname][parser]) for fname in fnames
+          if files[fname].get(parser, {}).get('rows')]
+
+
+def _iter_sections(fin, sections):
+  """ Yield (file, parser, record) from :sections: of the
+  indexed output in :fin:, seeking past everything else """
+  with fin:
+    for fname, parser, section in sections:
+      fin.seek(section['offset'])
+      for line in itertools.islice(fin, section['rows']):
+        yield fname, parser, json.loads(line)
+
+
+def _open(path):
+  try:
+    return open(path, 'rb')
+  except IOError as e:
+    logger.error("Could not read '{0}'".format(path))
+    logger.debug("IOError: {0}".format(e))
+    raise RuntimeError()
+
+
+def open_records(path, filefilter='*', parser=None):
+  """ Open a file output by `parse' and return an iterator
+  over (file, parser, record) tuples.
+
+  Records are read lazily, one at a time, whether the output
+  is JSON Lines or a single JSON document. Only the records
+  from :parser: in files matching :filefilter: are read from
+  indexed output (:parser: defaults to its first); the other
+  formats return every record.
+  """
+  fin = _open(path)
+  index = read_index(fin)
+  if index is not None:
+    return _iter_sections(fin, _sections(index, filefilter, parser))
+  if _is_jsonlines(fin):
+    return _iter_jsonlines(fin)
+  return _iter_json_stream(fin)
+
+
+def contents(path):
+  """ Return how many records each parser found in each file,
+  as {file: {parser: rows}}, from the output of `parse' at
+  :path:. Indexed and columnar output record this, other
+  formats are read through. """
+  if is_columnar(path):
+    with open(os.path.join(path, 'manifest.json')) as fin:
+      manifest = json.load(fin)
+    return dict((fname, dict((parser, entry['rows'])
+                             for parser, entry in parsers.iteritems()))
+                for fname, parsers in manifest['files'].iteritems())
+
+  with _open(path) as fin:
+    index = read_index(fin)
+  if index is not None:
+    return dict((fname, dict((parser, section['rows'])
+                             for parser, section in parsers.iteritems()))
+                for fname, parsers in index['files'].iteritems())
+
+  counts = {}
+  for fname, parser, _ in open_records(path):
+    parsers = counts.setdefault(fname, {})
+    parsers[parser] = parsers.get(parser, 0) + 1
+  return counts
+
+
+def split_records(path, filefilter='*', parser=None, piece_size=PIECE_SIZE):
+  """ Split the output of `parse' at :path: into pieces which
+  can be read independently (by different processes, say)
+  with read_piece.
+
+  Pieces only hold records from :parser: in files matching
+  :filefilter: where the format allows; :parser: defaults to
+  the first one. Indexed, columnar and JSON output is split by
+  file and parser, and JSON Lines output into runs of lines of
+  about :piece_size: bytes. A JSON document which wasn't
+  written by `parse' is a single piece.
+  """
+  if is_columnar(path):
+    with open(os.path.join(path, 'manifest.json')) as fin:
+      files = json.load(fin)['files']
+    fnames = fnmatch.filter(sorted(files), filefilter)
+    if parser is None and fnames and files[fnames[0]]:
+      parser = sorted(files[fnames[0]])[0]
+    return [('columnar', path, fname, parser) for fname in fnames
+            if files[fname].get(parser, {}).get('rows')]
+
+  with _open(path) as fin:
+    index = read_index(fin)
+    jsonlines = index is None and _is_jsonlines(fin)
+    arrays = None if index is not None or jsonlines else _json_arrays(fin)
+
+  if index is not None:
+    return [('section', path, section)
+            for section in _sections(index, filefilter, parser)]
+  if jsonlines:
+    from logparser.core import chunk_offsets
+    return [('lines', path, start, end)
+            for start, end in chunk_offsets(path, piece_size)]
+  if arrays is None:
+    return [('whole', path)]
+
+  # Like filter_records, default to the parser of the first record
+  if parser is None and arrays:
+    parser = arrays[0][1]
+  return [('array', path) + array for array in arrays
+          if array[1] == parser and fnmatch.fnmatch(array[0], filefilter)]
+
+
+def read_piece(piece, filefilter='*', parser=None):
+  """ Return an iterator over the (file, parser, record) tuples
+  in :piece:, one of those returned by split_records """
+  kind, path = piece[:2]
+  if kind == 'section':
+    return _iter_sections(_open(path), [piece[2]])
+  if kind == 'lines':
+    return _iter_jsonlines(_open(path), *piece[2:])
+  if kind == 'array':
+    return _iter_json_array(_open(path), *piece[2:])
+  if kind == 'columnar':
+    return _iter_columnar(path, *piece[2:])
+  return open_records(path, filefilter, parser)
+
+
+def _literal(name):
+  """ Return a pattern which fnmatch only matches with :name:
+
+  >>> fnmatch.fnmatch('a[1]*.log', _literal('a[1]*.log'))
+  True
+  >>> fnmatch.fnmatch('a1x.log', _literal('a[1]*.log'))
+  False
+  """
+  return re.sub(r'([*?[])', r'[\1]', name)
+
+
+def _scalar(value):
+  # NumPy scalars become the Python values they hold
+  item = getattr(value, 'item', None)
+  return value if item is None else item()
+
+
+def _iter_columnar(path, fname, parser):
+  """ Yield (file, parser, record) from the columns of :parser:
+  for :fname: in the columnar output at :path: """
+  frame = load_columnar(path, _literal(fname), parser)
+  if frame is None:
+    return
+
+  for row in frame.by_row(convert=_scalar):
+    yield fname, parser, dict(zip(frame.headers, row))
+
+
+def filter_records(records, filefilter, parser=None):
+  """ Yield (file, record) for each of :records:, an iterable
+  of (file, parser, record) tuples, which came from :parser:
+  and from a file matching :filefilter:. If :parser: is None,
+  use the parser of the first record.
+  """
+  matched = {}
+  for fname, record_parser, dp in records:
+    if parser is None:
+      parser = record_parser
+    if record_parser != parser:
+      continue
+
+    if fname not in matched:
+      matched[fname] = fnmatch.fnmatch(fname, filefilter)
+      if matched[fname]:
+        logger.info("Processing {0}".format(fname))
+    if matched[fname]:
+      yield fname, dp
+
+
+def record_headers(dp, label_files=False):
+  """ Return the columns of a table whose first row is the
+  record :dp:, in the order of their names as columnar output
+  has them """
+  # Only include headers which are standard datatypes
+  headernames = sorted(key
+                       for key, val in dp.iteritems()
+                       if isinstance(val, (float, int, basestring)))
+  if label_files:
+    headernames.append('file_')
+  return headernames
+
+
+def flatten_records(records, filefilter, parser=None, label_files=False):
+  """ Return a filtered set of :records:, an iterable
+  of (file, parser, record) tuples.
 
   Return data from :parser: and from files which
-  match :filefilter:.
+  match :filefilter:. If :parser: is None, use the
+  parser of the first record.
 
   If :label_files: is True, add a column to each row
   annotating which file it came from
   """
 
   datapoints = None
+  batch = []
+  batch_file = None
 
-  for fname in fnmatch.filter(json_data.iterkeys(), filefilter):
-    logger.info("Processing {0}".format(fname))
+  for fname, dp in filter_records(records, filefilter, parser):
     if datapoints is None:
-      # Only include headers which are standard datatypes
-      headernames = [key
-                     for key, val in json_data[fname][parser][0].iteritems()
-                     if isinstance(val, (float, int, basestring))]
+      field_types = infer_field_types([dp])
       if label_files:
-        headernames.append('file_')
+        field_types += (('file_', 'str'),)
+      datapoints = DataFrame(record_headers(dp, label_files), field_types)
 
-      datapoints = DataFrame(headernames)
+    if fname != batch_file or len(batch) >= BULK_ROWS:
+      if batch:
+        datapoints.extend(batch, file_=batch_file)
+      batch = []
+      batch_file = fname
+    batch.append(dp)
 
-    for dp in json_data[fname][parser]:
-      datapoints.add_row(file_=fname, **dp)
+  if batch:
+    datapoints.extend(batch, file_=batch_file)
 
   return datapoints
+
+
+def field_types(path, parser, opts):
+  """ Return the (name, type) of each field of :parser:, as far
+  as they are known: from the columns of the columnar output at
+  :path:, or else from the `field_types' of the parser loaded
+  with :opts:. Returns () if neither has them. """
+  if is_columnar(path):
+    with open(os.path.join(path, 'manifest.json')) as fin:
+      files = json.load(fin)['files']
+    for fname in sorted(files):
+      columns = files[fname].get(parser, {}).get('columns')
+      if columns:
+        return tuple((column['name'], column['type']) for column in columns)
+    return ()
+
+  from logparser.parsers import available_parsers
+  loaded = available_parsers(opts, [parser]).get(parser)
+  return tuple(getattr(loaded, 'field_types', None) or ())
+
+
+def is_columnar(path):
+  """ Check whether :path: was written by `parse --format columnar' """
+  return os.path.isfile(os.path.join(path, 'manifest.json'))
+
+
+def load_columnar(path, filefilter, parser=None, label_files=False):
+  """ Return a DataFrame of the data from :parser: in files
+  matching :filefilter:, from the columnar output at :path:.
+
+  Columns are memory-mapped rather than read. If more than one
+  file matches, their columns are joined in memory.
+  """
+  try:
+    import numpy
+  except ImportError as e:
+    logger.error("Reading columnar output requires numpy")
+    logger.debug("ImportError: {0}".format(e))
+    raise RuntimeError()
+
+  with open(os.path.join(path, 'manifest.json')) as fin:
+    manifest = json.load(fin)
+
+  fnames = fnmatch.filter(sorted(manifest['files']), filefilter)
+  if parser is None and fnames:
+    parser = sorted(manifest['files'][fnames[0]])[0]
+
+  parts = [(fname, manifest['files'][fname][parser]) for fname in fnames
+           if parser in manifest['files'][fname]]
+  if not parts:
+    return None
+
+  # A file the parser found nothing in may have no columns at
+  # all (when the parser has no field_types to go by), so it is
+  # left out unless every file is empty.
+  typed = [part for part in parts if part[1]['columns']] or parts[:1]
+  parts = [part for part in typed if part[1]['rows']] or typed[:1]
+
+  def load(column):
+    data = numpy.load(os.path.join(path, column['data']), mmap_mode='r')
+    if 'categories' in column:
+      categories = numpy.load(os.path.join(path, column['categories']),
+                              mmap_mode='r')
+      return DictColumn(data, categories)
+    return data
+
+  # Columns are in the order of their names, as they are when
+  # other formats are flattened
+  headers = sorted(column['name'] for column in parts[0][1]['columns'])
+  pieces = dict((name, []) for name in headers)
+  for fname, entry in parts:
+    logger.info("Processing {0}".format(fname))
+    for column in entry['columns']:
+      if column['name'] in pieces:
+        pieces[column['name']].append(load(column))
+
+  columns = {}
+  for name, arrays in pieces.iteritems():
+    if len(arrays) != len(parts):
+      logger.error("Column '{0}' is missing from some files".format(name))
+      raise RuntimeError()
+    if len(arrays) == 1:
+      columns[name] = arrays[0]
+    elif all(isinstance(arr, DictColumn) for arr in arrays):
+      columns[name] = DictColumn.concatenate(arrays)
+    else:
+      columns[name] = numpy.concatenate(arrays)
+
+  if label_files:
+    headers.append('file_')
+    columns['file_'] = DictColumn(
+        numpy.repeat(numpy.arange(len(parts), dtype='int32'),
+                     [entry['rows'] for _, entry in parts]),
+        numpy.array([fname for fname, _ in parts]))
+
+  return DataFrame.from_columns(headers, columns)
+
+
+def load_dataframe(path, filefilter, parser=None, label_files=False):
+  """ Load the output of `parse' at :path:, in whichever
+  format it was written, and flatten it into a DataFrame.
+  See flatten_records for the arguments.
+  """
+  if is_columnar(path):
+    return load_columnar(path, filefilter, parser, label_files=label_files)
+
+  records = open_records(path, filefilter, parser)
+  return flatten_records(records, filefilter, parser, label_files=label_files)
+
+
+def filter_and_flatten(json_data, filefilter, parser, label_files=False):
+  """ Return a filtered set of the :json_data:.
+
+  Return data from :parser: and from files which
+  match :filefilter:.
+
+  If :label_files: is True, add a column to each row
+  annotating which file it came from
+  """
+  return flatten_records(_iter_json(json_data), filefilter, parser,
+                         label_files=label_files)
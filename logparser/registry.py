@@ -0,0 +1,111 @@
+""" A cache of which parsers are defined where.
+
+Finding out which parsers exist means importing every parser
+module and reading every SimpleRegex definition. The registry
+remembers, for each module or definition file, the names and
+descriptions of the parsers it defined, along with its
+modification time and size. As long as a source hasn't changed,
+only the sources defining the parsers that are actually wanted
+have to be loaded.
+
+The registry lives in the logparser cache directory, which is
+$LOGPARSER_CACHE_DIR if set, or else logparser/ under
+$XDG_CACHE_HOME (~/.cache by default).
+"""
+import os
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def cache_dir():
+  """ Return the directory logparser keeps its caches in """
+  path = os.environ.get('LOGPARSER_CACHE_DIR')
+  if path:
+    return path
+
+  base = os.environ.get('XDG_CACHE_HOME') or \
+      os.path.join(os.path.expanduser('~'), '.cache')
+  return os.path.join(base, 'logparser')
+
+
+def stamp(path):
+  """ What the file at :path: looks like now, for telling
+  whether it changed since it was last read """
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  return [stat.st_mtime, stat.st_size]
+
+
+class Registry(object):
+  """ The names of the parsers defined by each source, stored
+  as JSON in :path: (by default parsers.json in cache_dir()).
+
+  Sources are keyed by a string (a module name or a file
+  path), and an entry is only used while the :stamp: it was
+  recorded with still matches.
+  """
+
+  VERSION = 1
+
+  def __init__(self, path=None):
+    self.path = path or os.path.join(cache_dir(), 'parsers.json')
+    self.sources = {}
+    self.changed = False
+
+    try:
+      with open(self.path) as fin:
+        data = json.load(fin)
+      if data.get('version') == self.VERSION:
+        self.sources = data['sources']
+    except (IOError, ValueError, KeyError):
+      pass
+
+  def get(self, key, stamp):
+    """ Return the entry for :key: if it was recorded with
+    :stamp:, or None """
+    entry = self.sources.get(key)
+    if entry is None or stamp is None or entry['stamp'] != stamp:
+      return None
+    return entry
+
+  def names(self, key, stamp):
+    """ Return a dictionary of the names and descriptions of
+    the parsers defined by :key:, or None if that isn't known
+    for the source as it is now """
+    entry = self.get(key, stamp)
+    if entry is None or 'parsers' not in entry:
+      return None
+    return entry['parsers']
+
+  def record(self, key, stamp, **values):
+    """ Remember :values: for the source :key: as it was at
+    :stamp:, along with anything else already known about it """
+    if stamp is None:
+      return
+    entry = dict(self.get(key, stamp) or {}, stamp=stamp, **values)
+    if self.sources.get(key) != entry:
+      self.sources[key] = entry
+      self.changed = True
+
+  def save(self):
+    """ Write the registry out if anything changed. Failing to
+    do so only makes the next run slower. """
+    if not self.changed:
+      return
+
+    tmp = self.path + '.{0}.tmp'.format(os.getpid())
+    try:
+      if not os.path.isdir(os.path.dirname(self.path)):
+        os.makedirs(os.path.dirname(self.path))
+      with open(tmp, 'w') as fout:
+        json.dump({'version': self.VERSION, 'sources': self.sources}, fout,
+                  indent=2, sort_keys=True)
+      os.rename(tmp, self.path)
+      self.changed = False
+    except (IOError, OSError) as e:
+      logger.debug("Couldn't save parser registry to '{0}': {1}"
+                   .format(self.path, e))
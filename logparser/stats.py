@@ -0,0 +1,143 @@
+""" Measuring what each parser costs.
+
+With `parse --stats', every parser is wrapped so that the lines
+it is given, the lines it matches, the lines whose matched
+values couldn't be converted and the time spent in it are
+counted. Lines a parser's prefilter rejects never reach it, so
+they aren't counted.
+
+Parsers are only wrapped when statistics are asked for, so
+they cost nothing otherwise.
+"""
+import json
+import timeit
+
+from logparser.parsers import ConversionError
+
+timer = timeit.default_timer
+
+FIELDS = ('lines', 'matches', 'misses', 'errors', 'seconds')
+
+
+class Counters(object):
+  """ The counts for one parser """
+  __slots__ = ('lines', 'matches', 'errors', 'seconds')
+
+  def __init__(self, lines=0, matches=0, errors=0, seconds=0.0, misses=None):
+    self.lines = lines
+    self.matches = matches
+    self.errors = errors
+    self.seconds = seconds
+
+  @property
+  def misses(self):
+    return self.lines - self.matches - self.errors
+
+  def add(self, other):
+    self.lines += other.lines
+    self.matches += other.matches
+    self.errors += other.errors
+    self.seconds += other.seconds
+
+  def as_dict(self):
+    return dict((field, getattr(self, field)) for field in FIELDS)
+
+
+class ParserStats(object):
+  """ Counters for a set of parsers, keyed by name.
+
+  >>> stats = ParserStats()
+  >>> match = stats.match('odd', lambda line: line if len(line) % 2 else None)
+  >>> [match(line) for line in ('a', 'ab', 'abc')]
+  ['a', None, 'abc']
+  >>> c = stats.parsers['odd']
+  >>> (c.lines, c.matches, c.misses, c.errors)
+  (3, 2, 1, 0)
+  """
+
+  def __init__(self):
+    self.parsers = {}
+
+  def counters(self, name):
+    counters = self.parsers.get(name)
+    if counters is None:
+      counters = self.parsers[name] = Counters()
+    return counters
+
+  def match(self, name, match):
+    """ Wrap the `match' callable of the parser :name: so that
+    it is counted. ConversionErrors (values which couldn't be
+    converted) are counted and raised again. """
+    counters = self.counters(name)
+
+    def counted(line):
+      start = timer()
+      try:
+        parsed = match(line)
+      except ConversionError:
+        counters.errors += 1
+        raise
+      finally:
+        counters.seconds += timer() - start
+        counters.lines += 1
+      if parsed is not None:
+        counters.matches += 1
+      return parsed
+
+    return counted
+
+  def batch(self, name, batch):
+    """ Wrap the `batch' callable of the parser :name: so that
+    it is counted. A block which fails isn't counted, as it
+    is parsed again line by line. """
+    counters = self.counters(name)
+
+    def counted(lines):
+      start = timer()
+      try:
+        found = batch(lines)
+      finally:
+        counters.seconds += timer() - start
+      counters.lines += len(lines)
+      counters.matches += len(found)
+      return found
+
+    return counted
+
+  def scanned(self, name, lines, found, seconds):
+    """ Count a memory-mapped scan by :name: over :lines:
+    lines which found :found: records """
+    counters = self.counters(name)
+    counters.lines += lines
+    counters.matches += found
+    counters.seconds += seconds
+
+  def merge(self, other):
+    """ Add the counts in :other:, as returned by as_dict """
+    for name, values in other.iteritems():
+      self.counters(name).add(Counters(**values))
+
+  def as_dict(self):
+    return dict((name, counters.as_dict())
+                for name, counters in self.parsers.iteritems())
+
+  def table(self):
+    """ Return the counts as a table, most expensive parser
+    first """
+    width = max([len('parser')] + [len(name) for name in self.parsers])
+    row = '{0:<{width}} {1:>10} {2:>10} {3:>10} {4:>8} {5:>9} {6:>8}'
+    rows = [row.format('parser', 'lines', 'matches', 'misses', 'errors',
+                       'seconds', 'us/line', width=width)]
+
+    by_time = sorted(self.parsers.iteritems(), key=lambda p: -p[1].seconds)
+    for name, c in by_time:
+      per_line = c.seconds / c.lines * 1e6 if c.lines else 0.0
+      rows.append(row.format(name, c.lines, c.matches, c.misses, c.errors,
+                             '{0:.3f}'.format(c.seconds),
+                             '{0:.2f}'.format(per_line), width=width))
+    return '\n'.join(rows)
+
+  def save(self, path):
+    with open(path, 'w') as fout:
+      json.dump({'version': 1, 'parsers': self.as_dict()}, fout, indent=2,
+                sort_keys=True)
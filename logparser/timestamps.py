@@ -0,0 +1,173 @@
+""" Fast conversion of log timestamps to seconds since the epoch.
+
+Syslog-style timestamps such as 'Aug 21 18:05:04.123' are parsed
+by hand, with the epoch of each hour cached so that only the
+minutes and seconds have to be worked out per line. Any other
+format, or any string the fast path doesn't understand, goes
+through strptime.
+"""
+import calendar
+import datetime
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_FORMAT = "%b %d %H:%M:%S.%f"
+
+# Formats the hand-rolled parser understands, and whether
+# they have fractional seconds.
+FAST_FORMATS = {
+    "%b %d %H:%M:%S": False,
+    "%b %d %H:%M:%S.%f": True
+}
+
+MONTHS = dict((name.lower(), i)
+              for i, name in enumerate(calendar.month_abbr) if name)
+
+
+def current_year():
+  """ The year to use for timestamps that don't have one. This
+  is looked up every time, so that a process which runs past
+  New Year (such as `follow') moves on to the new one. """
+  return datetime.date.today().year
+
+
+def year_of(month, today=None):
+  """ The year a timestamp in :month: (1 to 12) without a year
+  was most likely written in: the current one, except that
+  December is taken to be last year's while it is January, as
+  lines written just before New Year are read just after it.
+
+  >>> [year_of(month, datetime.date(2024, 1, 1)) for month in (1, 11, 12)]
+  [2024, 2024, 2023]
+  >>> year_of(12, datetime.date(2024, 12, 31))
+  2024
+  """
+  today = today or datetime.date.today()
+  if month == 12 and today.month == 1:
+    return today.year - 1
+  return today.year
+
+
+def _digits(s, maxlen=2):
+  if not s.isdigit() or len(s) > maxlen:
+    raise ValueError("Not a number: '{0}'".format(s))
+  return int(s)
+
+
+class TimestampParser(object):
+  """ Convert timestamp strings in the strptime format :fmt:
+  into integer seconds since the epoch (UTC). Timestamps
+  without a year are given the one year_of picks.
+
+  >>> parse = TimestampParser()
+  >>> parse('Aug 21 18:05:04.000') == parse('Aug 21 18:05:04.999')
+  True
+  >>> parse('Aug 21 18:05:04.000') - parse('Aug 20 18:05:03.000')
+  86401
+  >>> TimestampParser('%m/%d/%Y %I:%M:%S %p')('2/24/2012 4:25:22 PM')
+  1330100722
+  """
+
+  def __init__(self, fmt=DEFAULT_FORMAT):
+    self.fmt = fmt
+    self.fast = fmt in FAST_FORMATS
+    self.fraction = FAST_FORMATS.get(fmt, False)
+    # Epoch at the start of each hour, keyed by the timestamp
+    # up to the hour, e.g. 'Aug 21 18'. They are worked out
+    # for the current year, so are forgotten at New Year
+    # (`expires', in seconds since the epoch).
+    self.hours = {}
+    self.expires = 0
+
+  def _check_year(self):
+    if time.time() >= self.expires:
+      self.hours.clear()
+      self.expires = time.mktime((current_year() + 1, 1, 1, 0, 0, 0, 0, 0, -1))
+
+  def __call__(self, timestring):
+    if self.fast:
+      self._check_year()
+      try:
+        return self.parse_fast(timestring)
+      except (ValueError, KeyError):
+        pass
+
+    return self.parse_slow(timestring)
+
+  def parse_slow(self, timestring):
+    """ Parse :timestring: with strptime """
+    date = datetime.datetime.strptime(timestring, self.fmt)
+    if date.year == 1900:
+      date = date.replace(year=year_of(date.month))
+
+    return calendar.timegm(date.utctimetuple())
+
+  def parse_fast(self, timestring):
+    """ Parse a '%b %d %H:%M:%S[.%f]' :timestring: by hand.
+    Raises ValueError or KeyError for anything strptime
+    should look at instead. """
+    cut = timestring.index(':')
+    prefix = timestring[:cut]
+    base = self.hours.get(prefix)
+    if base is None:
+      base = self.hour(prefix)
+
+    minute, second = timestring[cut + 1:].split(':')
+    if self.fraction:
+      second, fraction = second.split('.')
+      if len(fraction) > 6 or not fraction.isdigit():
+        raise ValueError("Invalid fraction: '{0}'".format(fraction))
+
+    if len(minute) > 2 or len(second) > 2 or not (minute + second).isdigit():
+      raise ValueError("Invalid time: '{0}'".format(timestring))
+    minute = int(minute)
+    second = int(second)
+    if minute > 59 or second > 59:
+      raise ValueError("Invalid time: '{0}'".format(timestring))
+
+    return base + minute * 60 + second
+
+  def hour(self, prefix):
+    """ Work out and cache the epoch at the start of the
+    hour in :prefix: ('%b %d %H'), in the year given by
+    year_of """
+    month, day, hour = prefix.split()
+    hour = _digits(hour)
+    if hour > 23:
+      raise ValueError("Invalid hour: '{0}'".format(hour))
+
+    month = MONTHS[month.lower()]
+    date = datetime.date(year_of(month), month, _digits(day))
+    base = calendar.timegm(date.timetuple()) + hour * 3600
+    self.hours[prefix] = base
+    return base
+
+  def many(self, timestrings):
+    """ Convert a whole column of :timestrings: at once """
+    convert = self.parse_fast if self.fast else self.parse_slow
+    slow = self.parse_slow
+    self._check_year()
+
+    out = []
+    append = out.append
+    for timestring in timestrings:
+      try:
+        append(convert(timestring))
+      except (ValueError, KeyError):
+        append(slow(timestring))
+    return out
+
+
+_parsers = {}
+
+
+def parse_time(timestring, fmt=DEFAULT_FORMAT):
+  """ Convert :timestring: using a shared TimestampParser
+  for :fmt: """
+  try:
+    parser = _parsers[fmt]
+  except KeyError:
+    parser = _parsers[fmt] = TimestampParser(fmt)
+  return parser(timestring)